@@ -0,0 +1,68 @@
+# actor.py
+# Single writer for room state in thread mode. Client threads only read and
+# parse messages, then submit() them as commands. One state thread applies the
+# commands in batches, so SyncManager is never touched by two threads at once
+# and needs no locks, and each batch ends with one flush per room instead of a
+# broadcast per message. Server ticks run on the same thread.
+import queue
+import threading
+import time
+from metrics import metrics
+
+# Commands applied before the rooms are flushed, so a flood of messages can't hold back broadcasts
+MAX_BATCH = 256
+
+class StateThread:
+    def __init__(self, rooms):
+        self.rooms = rooms
+        self.commands = queue.SimpleQueue()  # (function, args) waiting to run on the state thread
+        metrics.gauge("command_queue", self.commands.qsize)
+
+    # Safe to call from any thread
+    def submit(self, function, *args):
+        self.commands.put((function, args))
+
+    def start(self):
+        self.rooms.defer_sync = True  # Rooms wait for flush() instead of broadcasting per message
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        next_tick = time.monotonic()
+        while True:
+            interval = self.rooms.tick_interval()
+            timeout = None
+            if interval:
+                timeout = max(0, next_tick - time.monotonic())
+            batch = []
+            try:
+                batch.append(self.commands.get(timeout=timeout))
+                while len(batch) < MAX_BATCH:
+                    batch.append(self.commands.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                started = time.perf_counter()
+                for function, args in batch:
+                    try:
+                        function(*args)
+                    except Exception as e:
+                        print(f"[!] Command error: {e}")
+                try:
+                    self.rooms.flush()
+                except Exception as e:
+                    print(f"[!] Flush error: {e}")
+                metrics.count("commands", len(batch))
+                metrics.observe("batch", time.perf_counter() - started)
+
+            now = time.monotonic()
+            if interval and now >= next_tick:
+                started = time.perf_counter()
+                try:
+                    self.rooms.tick()
+                except Exception as e:
+                    print(f"[!] Tick error: {e}")
+                metrics.observe("tick", time.perf_counter() - started)
+                next_tick += interval
+                if next_tick < now:
+                    next_tick = now  # Fell behind, don't try to catch up with a burst
@@ -0,0 +1,48 @@
+# assets.py
+# Images shared by every sprite. Each file is loaded and scaled once, each piece
+# of a sprite sheet is cut once and each tint is applied once, no matter how many
+# players, doors, keys and floor tiles use them. The surfaces handed out are
+# shared, so sprites must copy one before changing it.
+# pygame.display.set_mode() has to be called first, for convert_alpha().
+import functools
+import pygame
+from config import tile_size
+
+CHARACTER_SHEET = "img/character_sprites.png"
+CHARACTERS_PER_ROW = 6
+CHARACTER_COUNT = 24
+
+# An image file scaled to width x height
+@functools.lru_cache(maxsize=None)
+def image(file, width, height):
+    return pygame.transform.scale(pygame.image.load(file).convert_alpha(), (width, height))
+
+# The width x height area at (x, y) of a sheet
+@functools.lru_cache(maxsize=None)
+def sheet_piece(sheet, x, y, width, height):
+    piece = pygame.Surface([width, height], pygame.SRCALPHA)  # Create transparent surface
+    piece.blit(sheet, (0, 0), (x, y, width, height))
+    return piece
+
+# Every character of the character sheet, one tile in size, in sprite_counter order
+@functools.lru_cache(maxsize=None)
+def character_frames():
+    sheet = image(CHARACTER_SHEET, tile_size * CHARACTERS_PER_ROW, tile_size * (CHARACTER_COUNT // CHARACTERS_PER_ROW))
+    frames = []
+    for index in range(CHARACTER_COUNT):
+        x = (index % CHARACTERS_PER_ROW) * tile_size
+        y = (index // CHARACTERS_PER_ROW) * tile_size
+        frames.append(pygame.transform.scale(sheet_piece(sheet, x, y, 32, 32), (tile_size, tile_size)))
+    return frames
+
+def character(index):
+    return character_frames()[index % CHARACTER_COUNT]
+
+# The image blended with an RGB color, e.g. a door or key in its team color
+@functools.lru_cache(maxsize=None)
+def tinted(base, tint_color):
+    tinted_image = base.copy()
+    tint = pygame.Surface(base.get_size(), pygame.SRCALPHA)
+    tint.fill(tint_color)
+    tinted_image.blit(tint, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
+    return tinted_image
@@ -0,0 +1,57 @@
+# camera.py
+# What part of the world the window shows. Sprites keep world coordinates
+# (pixels from the top-left of the map) for movement and collisions, and are
+# moved into window coordinates only when they are drawn. Together with
+# TileIndex this keeps drawing proportional to the window, not to the map.
+import pygame
+from config import tile_size
+
+class Camera:
+    def __init__(self, width, height):
+        self.rect = pygame.Rect(0, 0, width, height)  # Visible area, in world pixels
+
+    # World rect -> window rect
+    def apply(self, rect):
+        return rect.move(-self.rect.x, -self.rect.y)
+
+    def sees(self, rect):
+        return self.rect.colliderect(rect)
+
+    # Centers the view on target (a world rect), without showing past the edges of a
+    # world_width x world_height pixel map. A map smaller than the window stays at the top left
+    # Returns how far the view moved as (dx, dy)
+    def follow(self, target, world_width, world_height):
+        x = max(0, min(target.centerx - self.rect.width // 2, world_width - self.rect.width))
+        y = max(0, min(target.centery - self.rect.height // 2, world_height - self.rect.height))
+        moved = (x - self.rect.x, y - self.rect.y)
+        self.rect.topleft = (x, y)
+        return moved
+
+
+# Walls, floors and doors by tile, so the tiles in an area are found without looking at the rest of the map
+class TileIndex:
+    def __init__(self):
+        self.cells = {}  # (tile x, tile y) -> tiles there, lowest layer first
+        self.width = 0   # Size of the map seen so far, in tiles
+        self.height = 0
+
+    def add(self, tile):
+        x, y = tile.rect.x // tile_size, tile.rect.y // tile_size
+        cell = self.cells.setdefault((x, y), [])
+        cell.append(tile)
+        cell.sort(key=lambda t: t._layer)
+        self.width = max(self.width, x + 1)
+        self.height = max(self.height, y + 1)
+
+    def remove(self, tile):
+        cell = self.cells.get((tile.rect.x // tile_size, tile.rect.y // tile_size))
+        if cell and tile in cell:
+            cell.remove(tile)
+
+    # Tiles at least partly inside area (a world rect), in drawing order
+    def in_area(self, area):
+        tiles = []
+        for y in range(area.top // tile_size, (area.bottom - 1) // tile_size + 1):
+            for x in range(area.left // tile_size, (area.right - 1) // tile_size + 1):
+                tiles.extend(self.cells.get((x, y), ()))
+        return tiles
@@ -2,49 +2,176 @@
 import socket
 import threading
 import json
+import os
 import sys
+import time
+import protocol
+from config import tile_map
+from framing import FrameReader
+from collections import deque
+from tilemap import expand_tile_map, expand_chunk, map_hash, decode_rows
 
 # IP address of the server (localhost by default).
 # Change this to the actual server IP when running on different machines.
 SERVER_IP = "127.0.0.1"
 PORT = 5555
+# Room to join. None lets the server matchmake into a room with a free slot.
+ROOM = None
+# Ask for position updates over UDP, falls back to TCP if the server doesn't offer it
+USE_UDP = True
+USE_COMPRESSION = True  # Ask the server to deflate what it sends
+# Most seconds moves go over TCP after we unlocked a door, in case the server never confirms it
+UNLOCK_CONFIRM_SECONDS = 2
+# How long to keep trying to get back into our session after the connection drops,
+# the server holds it for config.session_grace seconds
+RECONNECT_SECONDS = 30
+
+# Chunks around our own are requested from servers playing a large map file,
+# 1 keeps the 3x3 chunks around the player loaded
+CHUNK_RADIUS = 1
+
+# Downloaded maps are kept here by hash so the static layer is only fetched once
+MAP_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_cache")
 
 # Game state
 player_n = ""
 client_socket = None
 server_messages = []
 player_positions = {}  # player_name -> position
-game_objects = {}
+game_objects = {}   # Doors and keys
+static_objects = {}  # Walls and floors, built from the static map
+static_updates = deque()  # Lists of walls and floors from map chunks that arrived after the map was drawn
+chunked_map = None  # {hash, chunk_size, width, height} when the server streams its map in chunks
+requested_chunks = set()  # (chunk x, chunk y) already asked for
+objects_version = 0  # Last object state version applied to game_objects
+send_lock = threading.Lock()  # Acks are sent from the receive thread too
 player_passed_door = False
 game_pass = False
 sprite_counter = 0
+position_correction = None  # Position the server sent back after rejecting one of our moves
+wire_protocol = "json"  # Switched to "binary" if the server accepts it at join
+player_id = None
+player_ids = {}    # player_name -> entity id, used by the binary protocol
+player_names = {}  # entity id -> player_name
+udp_socket = None  # Connected UDP socket once the server offered one in its welcome
+udp_paired = False  # True after the server acknowledged our HELLO
+udp_send_seq = 0
+udp_recv_seq = 0
+room_name = None  # Room and match the server put us in, sent back when joining again to resume
+match_id = None
+session_token = None  # Lets us take our player back after a dropped connection
+pending_unlocks = {}  # door object id -> time we sent its unlock, until the server shows it unlocked
+
+# Applies a sync_positions message, from either TCP or UDP
+def apply_positions(message_dict):
+    global player_positions, sprite_counter
+    player_positions = message_dict["players"]
+    if player_n in player_positions:
+        request_chunks_near(player_positions[player_n]["x"], player_positions[player_n]["y"])
+    if len(player_positions) > 0:
+        sprite_counter = len(player_positions)-1
+    else:
+        sprite_counter = 0
 
 def receive_messages(sock):
-    global player_passed_door, game_pass
-    buffer = ""
+    global player_passed_door, game_pass, objects_version, wire_protocol, player_id, player_positions
+    global room_name, match_id, session_token, chunked_map
+    frames = FrameReader()
+    frames.enable_compression()
     while True:
         try:
-            data = sock.recv(1024).decode()
-            if not data:
+            if not frames.recv_from(sock):
                 break
-            buffer += data
-            while "\n" in buffer:
-                msg_json, buffer = buffer.split("\n", 1)
-                message_dict = json.loads(msg_json)
+            # The server may send JSON lines or binary frames, split off whatever is complete
+            for msg_type, payload in frames.messages():
+                message_dict = protocol.decode(msg_type, payload, player_names)
                 server_messages.append(message_dict)
                 #print("Received message:", message_dict)
                 if message_dict["type"] == "sync_positions":
-                    global player_positions
-                    player_positions = message_dict["players"]
-                    global sprite_counter
-                    if len(player_positions) > 0:
-                        sprite_counter = len(player_positions)-1
-                    else:
-                        sprite_counter = 0
+                    apply_positions(message_dict)
                 elif message_dict["type"] == "sync_objects":
-                    global game_objects
-                    game_objects = message_dict["objects"]
-                    
+                    # Full snapshot, replace contents in place so the game keeps the same dict
+                    game_objects.clear()
+                    game_objects.update(message_dict["objects"])
+                    if "version" in message_dict:
+                        objects_version = message_dict["version"]
+                        send_message({"type": "ack", "version": objects_version})
+
+                elif message_dict["type"] == "sync_delta":
+                    if message_dict["base"] > objects_version:
+                        # Missing changes between our version and the delta, ask for a snapshot
+                        send_message({"type": "resync"})
+                        continue
+                    game_objects.update(message_dict["added"])
+                    game_objects.update(message_dict["changed"])
+                    for object_id in message_dict["removed"]:
+                        game_objects.pop(object_id, None)
+                    objects_version = message_dict["version"]
+                    send_message({"type": "ack", "version": objects_version})
+
+                elif message_dict["type"] == "visibility":
+                    # Players that came into or left our area, build a new dict since the game loop reads the old one
+                    positions = dict(player_positions)
+                    positions.update(message_dict["entered"])
+                    for name in message_dict["left"]:
+                        positions.pop(name, None)
+                    player_positions = positions
+
+                elif message_dict["type"] == "correction":
+                    if message_dict["player"] == player_n:
+                        global position_correction
+                        position_correction = message_dict["position"]
+
+                elif message_dict["type"] == "join_rejected":
+                    print(f"[-] Server refused to let {message_dict.get('player')} join: {message_dict.get('reason')}")
+
+                elif message_dict["type"] == "welcome":
+                    wire_protocol = message_dict["protocol"]
+                    player_id = message_dict["player_id"]
+                    room_name = message_dict.get("room")
+                    match_id = message_dict.get("match")
+                    session_token = message_dict.get("session")
+                    if "udp_token" in message_dict:
+                        start_udp(message_dict["udp_port"], message_dict["udp_token"])
+
+                elif message_dict["type"] == "player_ids":
+                    player_ids.clear()
+                    player_ids.update(message_dict["players"])
+                    player_names.clear()
+                    player_names.update({entity_id: name for name, entity_id in player_ids.items()})
+
+                elif message_dict["type"] == "static_map":
+                    chunked_map = None
+                    if "chunk_size" in message_dict and load_cached_map(message_dict["hash"]) is None:
+                        # Too big to send whole, fetch the chunks around us as we move
+                        chunked_map = message_dict
+                        requested_chunks.clear()
+                        static_objects.clear()
+                        if player_n in player_positions:
+                            request_chunks_near(player_positions[player_n]["x"], player_positions[player_n]["y"])
+                        continue
+                    if "rows" in message_dict:
+                        rows = decode_rows(message_dict["rows"])
+                        if map_hash(rows) == message_dict["hash"]:
+                            save_cached_map(message_dict["hash"], rows)
+                    else:
+                        rows = load_cached_map(message_dict["hash"])
+                        if rows is None:
+                            # Cache was removed since we joined, download it after all
+                            send_message({"type": "get_static_map"})
+                            continue
+                    static, _, _ = expand_tile_map(rows)
+                    static_objects.clear()
+                    static_objects.update(static)
+
+                elif message_dict["type"] == "map_chunk":
+                    if chunked_map is None or message_dict["hash"] != chunked_map["hash"]:
+                        continue  # Left over from a map we no longer play
+                    size = chunked_map["chunk_size"]
+                    static = expand_chunk(decode_rows(message_dict["rows"]), message_dict["x"] * size, message_dict["y"] * size)
+                    static_objects.update(static)
+                    static_updates.append(list(static.values()))
+
                 elif message_dict["type"] == "player_passed_door":
                     print("Player passed the door:", message_dict["player"])
                     if message_dict["player"] == player_n:
@@ -57,6 +184,63 @@ def receive_messages(sock):
         except Exception as e:
             print("[-] Disconnected from server.")
             break
+    # Lost the connection we are still using (not one main() replaced), try to resume
+    if sock is client_socket and session_token and not game_pass:
+        reconnect()
+
+def reconnect():
+    deadline = time.monotonic() + RECONNECT_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(1)
+        try:
+            main(player_n)
+            print("[+] Reconnected to server.")
+            return
+        except OSError:
+            continue
+    print("[-] Could not reconnect to server.")
+
+# Opens the UDP side channel and pairs it with our TCP connection using the welcome token
+def start_udp(port, token):
+    global udp_socket
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.connect((SERVER_IP, port))
+    threading.Thread(target=receive_datagrams, args=(udp_socket, token), daemon=True).start()
+
+def receive_datagrams(sock, token):
+    global udp_paired, udp_recv_seq
+    hello = protocol.encode_datagram(protocol.DGRAM_HELLO, token)
+    sock.settimeout(0.2)
+    for _ in range(10):  # HELLO or its ack may be lost, retry a few times
+        try:
+            sock.send(hello)
+            data = sock.recv(2048)
+        except socket.timeout:
+            continue
+        except OSError:
+            break
+        if data == hello:
+            udp_paired = True
+            break
+    if not udp_paired:
+        print("[!] No UDP reply from server, positions stay on TCP")
+        return
+    sock.settimeout(None)
+    while True:
+        try:
+            data = sock.recv(2048)
+            dgram_type, seq, payload = protocol.decode_datagram(data)
+        except ValueError:
+            continue
+        except OSError:
+            break
+        if dgram_type != protocol.DGRAM_POSITIONS or seq <= udp_recv_seq:
+            continue  # Stale or reordered, a newer update already arrived
+        udp_recv_seq = seq
+        try:
+            apply_positions(protocol.decode(protocol.MSG_POSITIONS, payload, player_names))
+        except ValueError:
+            continue
 
 def get_sprite_counter():
     global sprite_counter
@@ -70,10 +254,74 @@ def get_player_position():
     global player_positions 
     return player_positions
 
+# Returns the last position correction from the server once, then None
+def take_position_correction():
+    global position_correction
+    correction, position_correction = position_correction, None
+    return correction
+
 def get_game_objects():
     global game_objects
     return game_objects
 
+def get_static_objects():
+    return static_objects
+
+# Walls and floors that arrived since the last call, for the game to add to the drawn map
+def take_static_updates():
+    objects = []
+    while static_updates:
+        objects += static_updates.popleft()
+    return objects
+
+# Map size in tiles as (width, height) when the map is streamed in chunks, None otherwise
+def get_map_size():
+    if chunked_map is None:
+        return None
+    return chunked_map["width"], chunked_map["height"]
+
+# Asks for the chunks within CHUNK_RADIUS of tile (x, y) that we don't have yet
+def request_chunks_near(x, y):
+    if chunked_map is None:
+        return
+    size = chunked_map["chunk_size"]
+    center_x, center_y = int(x) // size, int(y) // size
+    wanted = []
+    for cy in range(center_y - CHUNK_RADIUS, center_y + CHUNK_RADIUS + 1):
+        for cx in range(center_x - CHUNK_RADIUS, center_x + CHUNK_RADIUS + 1):
+            if (0 <= cx * size < chunked_map["width"] and 0 <= cy * size < chunked_map["height"]
+                    and (cx, cy) not in requested_chunks):
+                wanted.append([cx, cy])
+    if wanted:
+        requested_chunks.update((cx, cy) for cx, cy in wanted)
+        send_message({"type": "get_chunks", "chunks": wanted})
+
+# Hashes of every map this client can build without downloading it
+def cached_map_hashes():
+    hashes = [map_hash(tile_map)]  # The map bundled in config.py
+    if os.path.isdir(MAP_CACHE_DIR):
+        for file_name in os.listdir(MAP_CACHE_DIR):
+            if file_name.endswith(".txt"):
+                hashes.append(file_name[:-4])
+    return hashes
+
+def load_cached_map(hash_):
+    if hash_ == map_hash(tile_map):
+        return list(tile_map)
+    try:
+        with open(os.path.join(MAP_CACHE_DIR, hash_ + ".txt")) as f:
+            return f.read().split("\n")
+    except OSError:
+        return None
+
+def save_cached_map(hash_, rows):
+    try:
+        os.makedirs(MAP_CACHE_DIR, exist_ok=True)
+        with open(os.path.join(MAP_CACHE_DIR, hash_ + ".txt"), "w") as f:
+            f.write("\n".join(rows))
+    except OSError as e:
+        print(f"[!] Could not cache map: {e}")
+
 def get_player_passed_door():
     global player_passed_door
     return player_passed_door
@@ -84,8 +332,28 @@ def get_game_pass():
 
 # Connects to the server and sends actions as structured JSON messages
 def main(player_name):
-    global client_socket, player_n
+    global client_socket, player_n, wire_protocol, udp_socket, udp_paired, udp_send_seq, udp_recv_seq, session_token
+    if player_name != player_n:
+        session_token = None  # Someone else's session
     player_n = player_name
+    # Replacing an existing connection, close it so its threads stop
+    old_socket, old_udp = client_socket, udp_socket
+    client_socket = None
+    for sock in (old_socket, old_udp):
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # Wakes up a thread blocked in recv
+            except OSError:
+                pass
+            sock.close()
+    # Every connection starts out speaking JSON until the server's welcome says otherwise
+    wire_protocol = "json"
+    player_ids.clear()
+    player_names.clear()
+    udp_socket = None
+    udp_paired = False
+    udp_send_seq = 0
+    udp_recv_seq = 0
 
     # Create a TCP socket and connect to the server
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -95,7 +363,19 @@ def main(player_name):
     join_msg = {
         "type": "join",
         "player": player_name,
+        "map_hashes": cached_map_hashes(),
+        "protocols": ["binary", protocol.COMPRESSION, "json"] if USE_COMPRESSION else ["binary", "json"],
+        "udp": USE_UDP,
     }
+    if ROOM:
+        join_msg["room"] = ROOM
+    elif room_name:
+        join_msg["room"] = room_name  # Go back to the room we were in
+    if session_token:
+        join_msg["session"] = session_token  # Take over our player if the server still holds it
+    if match_id and game_objects:
+        # We still hold the objects of that match, the server only needs to send what changed since
+        join_msg["resume"] = {"match": match_id, "version": objects_version}
     client_socket.sendall((json.dumps(join_msg) + "\n").encode())
 
     # Start a thread to continuously receive messages from the server
@@ -113,6 +393,7 @@ def send_action(action, player_name, possessed_by, object_id=None, position=None
             "sprite_counter": object_id
         }
         send_message(message)
+        request_chunks_near(position[0], position[1])  # Ahead of the server's echo, so walls appear in time
 
     elif action == "pickup":
         message = {
@@ -129,6 +410,7 @@ def send_action(action, player_name, possessed_by, object_id=None, position=None
             "player": player_name,
             "object_id": object_id
         }
+        pending_unlocks[object_id] = time.monotonic()
         send_message(message)
     elif action == "delete_key":
         message = {
@@ -138,10 +420,31 @@ def send_action(action, player_name, possessed_by, object_id=None, position=None
         }
         send_message(message)
 
+# True while an unlock we sent is not confirmed yet. Moves then go over TCP behind it,
+# as a datagram the step into the door could reach the server first and be refused
+def unlock_pending():
+    now = time.monotonic()
+    for object_id, sent in list(pending_unlocks.items()):
+        door = game_objects.get(object_id)
+        if door is None or not door.get("locked") or now - sent > UNLOCK_CONFIRM_SECONDS:
+            pending_unlocks.pop(object_id, None)
+    return bool(pending_unlocks)
+
 def send_message(message):
+    global udp_send_seq
+    # Plain position updates can be lost without harm, send them as datagrams once paired
+    if udp_paired and message["type"] == "move" and message.get("sprite_counter") is None and not unlock_pending():
+        try:
+            frame = protocol.encode(message, wire_protocol, player_ids)
+            udp_send_seq += 1
+            udp_socket.send(protocol.encode_datagram(protocol.DGRAM_MOVE, udp_send_seq, frame[protocol.HEADER.size:]))
+            return
+        except Exception as e:
+            print(f"[!] UDP send error: {e}")
     try:
-        message_str = json.dumps(message)
-        client_socket.sendall((message_str + "\n").encode())
+        data = protocol.encode(message, wire_protocol, player_ids)
+        with send_lock:
+            client_socket.sendall(data)
     except Exception as e:
         print(f"[!] Send error: {e}")
 
@@ -31,6 +31,63 @@ item_layer = 2     # Layer for keys or other items
 wall_layer = 3     # Layer for walls and doors
 player_layer = 4   # Topmost layer for player sprites
 
+# Network sync settings
+# Number of object changes the server remembers for delta syncs.
+# Clients further behind than this get a full snapshot instead.
+delta_history = 256
+
+# Server ticks per second. Moves received between ticks are sent as one
+# sync_positions broadcast. Set to 0 to broadcast on every move instead.
+tick_rate = 20
+
+# Bytes that may wait in one client's outbound queue. Past this, stale
+# position updates are dropped, and if that is not enough the client is
+# disconnected so it cannot hold up anyone else.
+max_queue_bytes = 512 * 1024
+
+# Bytes read from a socket at a time. Each connection's receive buffer starts
+# at recv_buffer_start bytes, so idle connections stay cheap, and grows while
+# reads keep filling it and for larger messages, up to max_message_bytes; a peer
+# that sends a bigger message is disconnected.
+recv_buffer_size = 64 * 1024
+recv_buffer_start = 2 * 1024
+max_message_bytes = 16 * 1024 * 1024
+
+# Clients that ask for compression get their outgoing writes deflated once a
+# write is at least this many bytes; smaller ones go out as they are, since the
+# frame header would eat most of the saving.
+compress_min_bytes = 128
+
+# Map file made with mapfile.py, for maps too big for tile_map below. The
+# server memory-maps it and clients download only the chunks around them.
+# None plays tile_map.
+map_file = None
+
+# Players per matchmade room. Joins that name a room are not limited.
+max_players_per_room = 4
+
+# Players only get position updates for other players at most this many tiles
+# away on either axis, and are told when someone enters or leaves that area.
+# Larger than the bundled map so everyone sees everyone there. 0 turns it off.
+interest_radius = 32
+
+# Set event_log_dir (e.g. "match_logs") to append every accepted state change of a match
+# to <event_log_dir>/<match id>.jsonl, with a full snapshot every snapshot_every events.
+# replay.py plays these back. Off by default. A relative directory is taken from the
+# folder this file is in, not the working directory. Logs are only for replay, the
+# server never reads them back: resumes and rejoins are served from delta_history.
+# A match stops logging once its file is event_log_max_bytes long. When a match starts,
+# the logs of finished matches beyond the newest event_log_keep are deleted, the logs of
+# matches still running in other rooms or workers are left alone.
+event_log_dir = None
+snapshot_every = 500
+event_log_max_bytes = 64 * 1024 * 1024
+event_log_keep = 50
+
+# Seconds a dropped player's position and keys are held for them to resume
+# with their session token before they are removed. 0 removes them at once.
+session_grace = 30
+
 # Map layout using a list of strings
 # Each character represents a type of tile:
 # 'B' = Wall, '.' = Floor, 'D' = Door, 'K' = Key, 'P' = Player spawn point
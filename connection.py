@@ -0,0 +1,193 @@
+# connection.py
+# Per-client outbound queues. SyncManager hands every message to send(), which
+# only queues it; a writer per connection drains the queue onto the socket, so
+# a client on a slow link only ever delays its own updates.
+import abc
+import asyncio
+import socket
+import threading
+import zlib
+from collections import deque
+from config import max_queue_bytes, compress_min_bytes
+from metrics import metrics
+import protocol
+
+# Message kinds that carry a full state snapshot, an older queued one is useless once a newer one is queued
+COALESCE_KINDS = {"sync_positions"}
+
+# Largest chunk handed to the socket in one write
+WRITE_BATCH_BYTES = 64 * 1024
+
+# Queueing shared by both servers, subclasses supply wake() and close() for their writer
+class Connection(abc.ABC):
+    def __init__(self, addr, max_bytes=max_queue_bytes):
+        self.addr = addr
+        self.max_bytes = max_bytes
+        self.queue = deque()       # (data, kind, deflate) waiting to be written
+        self.queued_bytes = 0
+        self.closed = False
+        self.bytes_in = 0          # Counted by the server's read loop
+        self.bytes_out = 0         # Counted by the writer once the data is on the socket
+        self.compressor = None     # Deflate stream of this connection once compression was negotiated
+        self.lock = threading.Lock()
+        metrics.add_connection(self)
+
+    # Queues data for this client, never blocks the caller
+    def send(self, data, kind=None):
+        with self.lock:
+            if self.closed:
+                return
+            if self.queued_bytes + len(data) > self.max_bytes:
+                metrics.count("queue.over_limit")
+            # Whether a message is deflated is fixed here, so one queued before
+            # enable_compression() still goes out as plain bytes
+            self.queue.append((data, kind, self.compressor is not None))
+            self.queued_bytes += len(data)
+            if self.queued_bytes > self.max_bytes:
+                # Slow consumer: first throw away stale position updates
+                self.coalesce()
+            # Only what was already waiting counts, so one message bigger than the limit
+            # (the objects of a large map) still goes out to a client that keeps up
+            too_slow = self.queued_bytes - len(data) > self.max_bytes
+            if not too_slow:
+                self.wake()
+        if too_slow:
+            # Still over the limit, this client cannot keep up
+            print(f"[!] Client {self.addr} is too slow, disconnecting")
+            metrics.count("disconnect.too_slow")
+            self.close()
+
+    # Drops every queued snapshot message except the newest of each kind
+    def coalesce(self):
+        kept = deque()
+        seen = set()
+        for entry in reversed(self.queue):
+            data, kind, _ = entry
+            if kind in COALESCE_KINDS:
+                if kind in seen:
+                    self.queued_bytes -= len(data)
+                    continue
+                seen.add(kind)
+            kept.appendleft(entry)
+        self.queue = kept
+
+    # Pops queued messages into one buffer for a single write, call with the lock held
+    # Returns (data, deflate), a batch never mixes messages queued before and after enable_compression()
+    def take_batch(self):
+        chunks = []
+        size = 0
+        deflate = self.queue[0][2] if self.queue else False
+        while self.queue and size < WRITE_BATCH_BYTES and self.queue[0][2] == deflate:
+            data, _, _ = self.queue.popleft()
+            chunks.append(data)
+            size += len(data)
+        self.queued_bytes -= size
+        return b"".join(chunks), deflate
+
+    # Messages sent after this go out compressed (see protocol.MSG_ZLIB), ones already
+    # queued, like the welcome that announced compression, are still written as they are
+    def enable_compression(self):
+        with self.lock:
+            if self.compressor is None:
+                self.compressor = protocol.new_compressor()
+
+    # Deflates a batch that take_batch marked for it, if it is worth it. Only the writer
+    # calls this, after coalescing, so every compressed byte reaches the client in stream order.
+    def compress(self, data, deflate):
+        if not deflate or len(data) < compress_min_bytes:
+            return data
+        compressed = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        metrics.count("compression.bytes_in", len(data))
+        metrics.count("compression.bytes_out", len(compressed))
+        return protocol.encode_frame(protocol.MSG_ZLIB, compressed)
+
+    # Tells the writer that the queue has data, called with the lock held
+    @abc.abstractmethod
+    def wake(self):
+        pass
+
+    # Drops the queue and ends the connection, safe to call more than once
+    @abc.abstractmethod
+    def close(self):
+        pass
+
+
+# Socket connection drained by its own writer thread, used by the threaded server
+class ThreadedConnection(Connection):
+    def __init__(self, sock, addr, max_bytes=max_queue_bytes):
+        super().__init__(addr, max_bytes)
+        self.sock = sock
+        self.ready = threading.Condition(self.lock)
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def wake(self):
+        self.ready.notify()
+
+    def write_loop(self):
+        while True:
+            with self.ready:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if self.closed:
+                    return
+                data, deflate = self.take_batch()
+            data = self.compress(data, deflate)
+            try:
+                self.sock.sendall(data)  # Only this thread waits on a slow link
+                self.bytes_out += len(data)
+            except OSError:
+                self.close()
+                return
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.clear()
+            self.queued_bytes = 0
+            self.ready.notify_all()
+        try:
+            # Wakes up the reading thread too, which then runs the normal disconnect cleanup
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+# asyncio stream drained by a writer task, used by the asyncio server
+# Must be created on the event loop thread
+class AsyncConnection(Connection):
+    def __init__(self, writer, max_bytes=max_queue_bytes):
+        super().__init__(writer.get_extra_info("peername"), max_bytes)
+        self.writer = writer
+        self.ready = asyncio.Event()
+        self.task = asyncio.get_running_loop().create_task(self.write_loop())
+
+    def wake(self):
+        self.ready.set()
+
+    async def write_loop(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue and not self.closed:
+                    with self.lock:
+                        data, deflate = self.take_batch()
+                    data = self.compress(data, deflate)
+                    self.writer.write(data)
+                    await self.writer.drain()  # Waits only for this client's socket
+                    self.bytes_out += len(data)
+        except (ConnectionError, OSError):
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.clear()
+            self.queued_bytes = 0
+        self.ready.set()
+        # Closing the transport ends the reader with EOF, which runs the normal disconnect cleanup
+        self.writer.close()
@@ -0,0 +1,153 @@
+# eventlog.py
+# Append-only log of every state change a match accepted, with a full snapshot
+# every few hundred events. One file per match, one compact JSON array per line:
+#
+#   [ms, "h", {"match", "room", "map", "started"}]        header, first line
+#   [ms, "s", {"version", "players", "objects"}]          snapshot
+#   [ms, "j", name, x, y]                                 join
+#   [ms, "m", name, x, y, sprite_counter]                 accepted move
+#   [ms, "p", version, object_id, possessed_by]           key picked up
+#   [ms, "u", version, object_id]                         door unlocked
+#   [ms, "d", version, object_id]                         key used up
+#   [ms, "l", version, name]                              leave, releases the player's keys
+#
+# ms counts from the start of the match. version is the object state version
+# after the event. replay.py rebuilds the match from this with apply_event.
+# The server only ever writes these files, nothing it restores comes from them.
+import json
+import os
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows, where a file open for writing can't be removed anyway
+
+class EventLog:
+    def __init__(self, path, header, snapshot_every):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.since_snapshot = 0
+        self.started = time.monotonic()
+        self.file = open(path, "a")
+        if fcntl is not None:
+            fcntl.flock(self.file, fcntl.LOCK_EX)  # Held until close, tells prune_logs the match is still running
+        self.size = self.file.tell()  # Bytes in the file so far
+        self.write("h", header)
+
+    def write(self, kind, *fields):
+        line = json.dumps([int((time.monotonic() - self.started) * 1000), kind, *fields], separators=(",", ":"))
+        self.file.write(line + "\n")
+        self.size += len(line) + 1
+
+    def append(self, kind, *fields):
+        self.write(kind, *fields)
+        self.since_snapshot += 1
+
+    # True once enough events were written that replay should get a fresh starting point
+    def snapshot_due(self):
+        return self.since_snapshot >= self.snapshot_every
+
+    def snapshot(self, version, players, objects):
+        self.write("s", {"version": version, "players": players, "objects": objects})
+        self.since_snapshot = 0
+        self.file.flush()  # A crash loses at most the events after the last snapshot
+
+    def close(self):
+        self.file.close()
+
+
+# Keeps the newest keep logs of finished matches in directory and deletes the older ones.
+# Logs of matches still running, in any room or worker, are never deleted and don't
+# count, even when their buffered writes make them look old.
+def prune_logs(directory, keep):
+    logs = []
+    for name in os.listdir(directory):
+        if name.endswith(".jsonl"):
+            path = os.path.join(directory, name)
+            try:
+                logs.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # Removed meanwhile by another worker
+    logs.sort(reverse=True)
+    for _, path in logs:
+        if log_in_use(path):
+            continue
+        if keep > 0:
+            keep -= 1
+        else:
+            remove_log(path)
+
+# True while an EventLog, in this process or another, has the file open
+def log_in_use(path):
+    if fcntl is None:
+        return False  # Can't tell, remove_log finds out instead
+    try:
+        with open(path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    except OSError:
+        pass
+    return False
+
+def remove_log(path):
+    try:
+        if fcntl is None:
+            os.remove(path)
+            return
+        with open(path, "rb") as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)  # Removed only while nobody writes it
+            os.remove(path)
+    except (BlockingIOError, FileNotFoundError):
+        pass  # Opened again or already removed by another worker
+    except PermissionError:
+        if fcntl is not None:
+            print(f"[!] Could not remove old event log {path}: permission denied")
+        # Otherwise it is still open, Windows refuses to remove it
+    except OSError as e:
+        print(f"[!] Could not remove old event log {path}: {e}")
+
+
+def read_log(path):
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+def new_state():
+    return {"version": 0, "players": {}, "objects": {}}
+
+# Applies one log record to a plain state dict, the same change SyncManager made
+def apply_event(state, record):
+    kind = record[1]
+    if kind == "s":
+        snapshot = record[2]
+        state["version"] = snapshot["version"]
+        state["players"] = {name: dict(pos) for name, pos in snapshot["players"].items()}
+        state["objects"] = {object_id: dict(obj) for object_id, obj in snapshot["objects"].items()}
+    elif kind == "j":
+        _, _, name, x, y = record
+        state["players"][name] = {"x": x, "y": y}
+    elif kind == "m":
+        _, _, name, x, y, sprite_counter = record
+        state["players"][name] = {"x": x, "y": y, "sprite_counter": sprite_counter}
+    elif kind == "p":
+        _, _, version, object_id, possessed_by = record
+        state["objects"][object_id]["possessed_by"] = possessed_by
+        state["version"] = version
+    elif kind == "u":
+        _, _, version, object_id = record
+        state["objects"][object_id]["locked"] = False
+        state["version"] = version
+    elif kind == "d":
+        _, _, version, object_id = record
+        state["objects"].pop(object_id, None)
+        state["version"] = version
+    elif kind == "l":
+        _, _, version, name = record
+        state["players"].pop(name, None)
+        for obj in state["objects"].values():
+            if obj.get("possessed_by") == name:
+                obj["possessed_by"] = None
+        state["version"] = version
@@ -0,0 +1,110 @@
+# framing.py
+# Incremental reader for the message stream described in protocol.py: newline
+# terminated JSON and length-prefixed binary frames, mixed freely.
+#
+# Data is received straight into one growable bytearray with recv_into (or
+# copied in once with feed() for asyncio streams), and the search for a
+# newline resumes where the last read stopped. A sync_objects spread over
+# dozens of reads is therefore handled in linear time, without re-copying and
+# re-scanning the whole buffer on every read.
+#
+# After enable_compression() MSG_ZLIB frames are inflated on the way and the
+# messages inside them are returned in their place.
+from config import recv_buffer_size, recv_buffer_start, max_message_bytes
+from protocol import FRAME_MAGIC, HEADER, MSG_JSON, MSG_ZLIB, new_decompressor
+
+class FrameReader:
+    def __init__(self, size=recv_buffer_size, max_message=max_message_bytes, start_size=recv_buffer_start):
+        self.buffer = bytearray(min(start_size, size))  # Grown by reserve() when more is needed
+        self.view = memoryview(self.buffer)
+        self.start = 0    # First byte not yet returned as part of a message
+        self.end = 0      # End of the received data
+        self.scan = 0     # Where the search for the next newline continues
+        self.read_size = size  # Most bytes asked for in one recv
+        self.max_message = max_message
+        self.inflater = None  # Decompressor of the peer's deflate stream
+        self.inflated = None  # FrameReader for the messages inside MSG_ZLIB frames
+
+    # Safe to call before the peer agreed, MSG_ZLIB frames only arrive if it did
+    def enable_compression(self):
+        if self.inflater is None:
+            self.inflater = new_decompressor()
+            self.inflated = FrameReader(self.read_size, self.max_message)
+
+    # Returns the messages held in one MSG_ZLIB payload
+    def inflate(self, payload):
+        # A compressed write holds whole messages, at most one of them bigger than a write batch
+        data = self.inflater.decompress(payload, 2 * self.max_message)
+        if self.inflater.unconsumed_tail:
+            raise ValueError("compressed frame expands past the message size limit")
+        self.inflated.feed(data)
+        return self.inflated.messages()
+
+    # Makes room for at least needed more bytes after end
+    def reserve(self, needed):
+        if len(self.buffer) - self.end >= needed:
+            return
+        pending = bytes(self.view[self.start:self.end])  # The unfinished message, usually short
+        if len(pending) + needed > len(self.buffer):
+            self.view.release()
+            self.buffer = bytearray(max(len(self.buffer) * 2, len(pending) + needed))
+            self.view = memoryview(self.buffer)
+        self.buffer[:len(pending)] = pending
+        self.scan = max(0, self.scan - self.start)
+        self.start = 0
+        self.end = len(pending)
+
+    # Receives once from a blocking socket, returns the byte count (0 when the peer closed)
+    def recv_from(self, sock):
+        self.reserve(min(self.read_size, len(self.buffer)))
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        if self.end == len(self.buffer) and len(self.buffer) < self.read_size:
+            self.reserve(len(self.buffer))  # The read filled the buffer, read more at a time from now on
+        return count
+
+    # Appends data that was already read, e.g. by an asyncio StreamReader
+    def feed(self, data):
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    # Returns [(msg_type, payload bytes), ...] for every complete message, JSON lines come back as MSG_JSON
+    # max_messages stops early and keeps the rest for later
+    # Raises ValueError if a message is bigger than max_message, the stream can't be trusted after that
+    def messages(self, max_messages=None):
+        messages = []
+        buffer = self.buffer
+        while self.start < self.end and (max_messages is None or len(messages) < max_messages):
+            start = self.start
+            if buffer[start] == FRAME_MAGIC:
+                if self.end - start < HEADER.size:
+                    break
+                _, msg_type, length = HEADER.unpack_from(buffer, start)
+                if length > self.max_message:
+                    raise ValueError(f"frame of {length} bytes is over the limit")
+                frame_end = start + HEADER.size + length
+                if frame_end > self.end:
+                    break
+                payload = bytes(self.view[start + HEADER.size:frame_end])
+                self.start = frame_end
+                if msg_type == MSG_ZLIB and self.inflater is not None:
+                    messages.extend(self.inflate(payload))
+                else:
+                    messages.append((msg_type, payload))
+            else:
+                newline = buffer.find(b"\n", max(start, self.scan), self.end)
+                if newline == -1:
+                    if self.end - start > self.max_message:
+                        raise ValueError("line is over the message size limit")
+                    self.scan = self.end  # Only new data needs searching next time
+                    break
+                messages.append((MSG_JSON, bytes(self.view[start:newline])))
+                self.start = newline + 1
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0  # Everything consumed, reuse the buffer from the front
+        return messages
+
+    # Received bytes that are not part of a returned message yet
+    def leftover(self):
+        return bytes(self.view[self.start:self.end])
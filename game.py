@@ -5,6 +5,8 @@ from sprites import *
 from config import *
 import sys
 import client
+import assets
+from camera import Camera, TileIndex
 # Main game class that handles game state, drawing, and logic
 class Game:
     def __init__(self):
@@ -24,7 +26,7 @@ class Game:
 
         # Load all sprite resources
         self.items = pygame.sprite.Group()
-        self.spritesheet = CharSprite("img/character_sprites.png")
+        assets.character_frames()  # Cut out every character now, so players joining later cost nothing
         self.wall_img = Sprite("img/wall.png")
         self.door_img = Sprite("img/door.png")
         self.floor_img = CharSprite("img/floor.png")
@@ -91,11 +93,23 @@ class Game:
     def new(self):
         self.all_sprites = pygame.sprite.LayeredUpdates()
         self.blocks = pygame.sprite.LayeredUpdates()
+        self.tiles = TileIndex()  # Walls, floors and doors, drawn into the background
+        self.dirty_sprites = pygame.sprite.LayeredDirty()  # Views of players and keys, and messages, redrawn only where they changed
+        self.camera = Camera(*self.screen.get_size())
+        self.background = pygame.Surface(self.screen.get_size()).convert()
+        self.background_dirty = []  # Areas of the background whose tiles changed since the last frame
+        self.repaint_all = True
         self.players = {}  # Clear existing players
+        self.doors = {}  # Door sprites by object id, until they unlock
+        self.keys = {}  # Key sprites by object id
+        self.locked_doors = {}  # color -> {object id: Door} of the doors still locked
+        self.keys_by_carrier = {}  # player name -> keys they carry, in pickup order
+        self.players_by_tile = {}  # (tile x, tile y) -> players touching that tile, rebuilt every frame
         self.spawn_points = []  # Reset spawn points
         start = time.time()
-        while not client.get_game_objects() and time.time() - start < 5:
+        while not (client.get_game_objects() and client.get_static_objects()) and time.time() - start < 5:
             pygame.time.wait(100)
+        client.take_static_updates()  # Already part of the static objects drawn below
         self.create_tilemap()
         self.playing = True
         TutorialMessage(self, "Press WASD to move – Press R to restart", duration=60000)
@@ -134,9 +148,22 @@ class Game:
                     #print("[DEBUG] R key pressed – restarting game.")
                     self.restart()
 
+            elif event.type == pygame.VIDEOEXPOSE:
+                self.repaint_all = True  # Window was covered or restored, what's on screen is lost
+
     # Updates all game objects
     def update(self):
+        self.index_players()  # Keys look up who touches them here before anyone moves this frame
         self.all_sprites.update()
+        for object in client.take_static_updates():
+            self.create_object(object)  # Map chunks that arrived as we moved
+        correction = client.take_position_correction()
+        if correction and player_name in self.players:
+            # Server rejected a move, snap back to the last position it accepted
+            player = self.players[player_name]
+            player.rect.topleft = (correction[0] * tile_size, correction[1] * tile_size)
+            player.target_pos = player.rect.topleft
+            player.moving = False
         positions = client.get_player_position()
         for name, pos in positions.items():
             #print(f"[DEBUG] Updating position for {name}: {pos}")
@@ -150,22 +177,17 @@ class Game:
                 player.x = pos["x"] * tile_size
                 player.y = pos["y"] * tile_size
                 player.rect.topleft = (player.x , player.y)
-        for player in self.players:
-            if player not in positions:
-                self.players[player].kill()
-                del self.players[player]
-                break
+        # Players that left or moved out of our area of interest
+        for player in [name for name in self.players if name not in positions]:
+            self.players[player].kill()
+            del self.players[player]
         objects = client.get_game_objects()
-        for object in objects.values():
-            for door in self.doors:
-                if self.doors[door].objectid == object["id"]:
-                    self.doors[door].locked = object["locked"] 
-                    if not object["locked"]:
-                        self.doors[door].locked = True
-                        #print(f"[DEBUG] Door {door} unlocked!")
-                        self.doors[door].unlock()
-                        del self.doors[door]
-                        break
+        for object in list(objects.values()):  # Updated in place by the network thread
+            door = self.doors.get(object["id"])
+            if door is not None and not object["locked"]:
+                #print(f"[DEBUG] Door {door.objectid} unlocked!")
+                door.unlock()
+                del self.doors[object["id"]]
             if object["type"] == "key":
                 if(object["id"] not in self.keys):
                     del self.keys[object["id"]]
@@ -179,46 +201,139 @@ class Game:
 
 
     # Draws all game objects to the screen
+    # Tiles only change when a door unlocks or a map chunk arrives, so the ones in view
+    # are kept in self.background and only the changed area of it is redrawn. When the
+    # camera moves the background is scrolled and only the tiles that came into view
+    # are drawn. Everything else is redrawn where it moved, and only those parts of
+    # the window are updated.
     def draw(self):
-        self.screen.fill(black)
-        for sprite in self.all_sprites:
-            self.screen.blit(sprite.image, sprite.rect)
-        
+        window = self.screen.get_rect()
+        dx, dy = self.follow_player()
+        if self.repaint_all or abs(dx) >= window.width or abs(dy) >= window.height:
+            self.repaint_background(self.camera.rect)
+            self.show_background(window)
+            self.background_dirty = []
+            self.repaint_all = False
+        elif dx or dy:
+            self.background.scroll(-dx, -dy)
+            view = self.camera.rect
+            if dx:
+                self.repaint_background(pygame.Rect(view.right - dx if dx > 0 else view.left, view.top, abs(dx), view.height))
+            if dy:
+                self.repaint_background(pygame.Rect(view.left, view.bottom - dy if dy > 0 else view.top, view.width, abs(dy)))
+            self.show_background(window)
+        if self.background_dirty:
+            area = self.background_dirty[0].unionall(self.background_dirty[1:])
+            shown = self.repaint_background(area)
+            if shown:
+                self.show_background(shown)
+            self.background_dirty = []
+
+        for sprite in self.dirty_sprites:
+            sprite.follow(self.camera)
+        self.dirty_sprites.clear(self.screen, self.background)
+        changed = self.dirty_sprites.draw(self.screen)
+
         self.clock.tick(60)
         #WALL COLLISION [DEBUG]
         #for wall in self.blocks:
         #    pygame.draw.rect(self.screen, (255, 0, 0), wall.rect, 2)
-        pygame.display.update()
+        pygame.display.update(changed)
+
+    # Keeps the main player in the middle of the window, returns how far the camera moved
+    def follow_player(self):
+        player = self.players.get(player_name)
+        if player is None:
+            return (0, 0)
+        width, height = client.get_map_size() or (self.tiles.width, self.tiles.height)
+        return self.camera.follow(player.rect, width * tile_size, height * tile_size)
+
+    # Redraws the tiles of area (a world rect) that are in view, returns where that is in the window
+    def repaint_background(self, area):
+        area = area.clip(self.camera.rect)
+        if not area:
+            return None
+        shown = self.camera.apply(area)
+        self.background.set_clip(shown)
+        self.background.fill(black)
+        for tile in self.tiles.in_area(area):
+            self.background.blit(tile.image, self.camera.apply(tile.rect))
+        self.background.set_clip(None)
+        return shown
+
+    # Copies part of the background (a window rect) to the window, players and keys there go back on top
+    def show_background(self, shown):
+        self.screen.blit(self.background, shown, shown)
+        self.dirty_sprites.repaint_rect(shown)
+
+    # Called by tiles when they are added or removed, the area is redrawn on the next frame
+    def add_tile(self, tile):
+        self.tiles.add(tile)
+        self.background_dirty.append(tile.rect.copy())
+
+    def remove_tile(self, tile):
+        self.tiles.remove(tile)
+        self.background_dirty.append(tile.rect.copy())
 
     # Creates game world from tile_map config
 
     def create_tilemap(self):
-        objects = client.get_game_objects()
-        for object in objects.values():
-            if object["type"] == "wall":
-                Wall(self, object["x"],     object["y"], object["id"])
-            elif object["type"] == "door":
-                Floor(self, object["x"], object["y"], object["id"])
-                door = Door(self, object["x"], object["y"], object["id"], color=object.get("color", "red"))
-                self.doors[object["id"]] = door
-            elif object["type"] == "key":
-                Floor(self, object["x"], object["y"], object["id"])
-                key = Key(self, object["x"], object["y"], object["id"], color=object.get("color", "yellow"))
-                self.keys[object["id"]] = key
-            elif object["type"] == "floor":
-                Floor(self, object["x"], object["y"], object["id"])
+        objects = list(client.get_static_objects().values()) + list(client.get_game_objects().values())
+        for object in objects:
+            self.create_object(object)
+
+    def create_object(self, object):
+        if object["type"] == "wall":
+            Wall(self, object["x"],     object["y"], object["id"])
+        elif object["type"] == "door":
+            Floor(self, object["x"], object["y"], object["id"])
+            door = Door(self, object["x"], object["y"], object["id"], color=object.get("color", "red"))
+            self.doors[object["id"]] = door
+        elif object["type"] == "key":
+            Floor(self, object["x"], object["y"], object["id"])
+            key = Key(self, object["x"], object["y"], object["id"], color=object.get("color", "yellow"))
+            self.keys[object["id"]] = key
+        elif object["type"] == "floor":
+            Floor(self, object["x"], object["y"], object["id"])
         
 
     #Create new instance of game
     def restart(self):
         self.new()   # Reset game objects, map, etc.
 
+    # Players in the tiles rect touches, without looking at the other players
+    def players_touching(self, rect):
+        players = []
+        for y in range(rect.top // tile_size, (rect.bottom - 1) // tile_size + 1):
+            for x in range(rect.left // tile_size, (rect.right - 1) // tile_size + 1):
+                for player in self.players_by_tile.get((x, y), ()):
+                    if player not in players:
+                        players.append(player)
+        return players
+
+    def index_players(self):
+        self.players_by_tile = {}
+        for player in self.players.values():
+            rect = player.rect
+            for y in range(rect.top // tile_size, (rect.bottom - 1) // tile_size + 1):
+                for x in range(rect.left // tile_size, (rect.right - 1) // tile_size + 1):
+                    self.players_by_tile.setdefault((x, y), []).append(player)
+
+    def carry_key(self, key, player):
+        key.carried_by = player
+        self.keys_by_carrier.setdefault(player.player_name, []).append(key)
+
+    def drop_key(self, key):
+        carried = self.keys_by_carrier.get(key.carried_by.player_name, [])
+        if key in carried:
+            carried.remove(key)
+        key.carried_by = None
+
     #check win con
     def check_win_condition(self):
         # If there are no locked doors left, trigger win
-        for sprite in self.all_sprites:
-            if hasattr(sprite, "locked") and sprite.locked:
-                return  # Still at least one locked door
+        if any(self.locked_doors.values()):
+            return  # Still at least one locked door
 
         # If we get here, all doors are unlocked!
         #print("[DEBUG] All doors are unlocked! YOU WIN!")
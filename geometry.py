@@ -0,0 +1,23 @@
+# geometry.py
+# Rectangle helpers for the server-side game logic, which runs without pygame.
+# They follow pygame.Rect's rules, so results match what the client computes:
+# coordinates are truncated to ints, and rectangles that only share an edge or
+# have no area do not overlap.
+
+# (x, y, width, height) with int coordinates, like pygame.Rect(x, y, width, height)
+# A negative size extends left or up from x or y, the way colliderect treats it
+def rect(x, y, width, height):
+    x, y, width, height = int(x), int(y), int(width), int(height)
+    if width < 0:
+        x, width = x + width, -width
+    if height < 0:
+        y, height = y + height, -height
+    return (x, y, width, height)
+
+# Same result as pygame.Rect.colliderect
+def rects_overlap(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    if aw <= 0 or ah <= 0 or bw <= 0 or bh <= 0:
+        return False
+    return ax < bx + bw and bx < ax + aw and ay < by + bh and by < ay + ah
@@ -0,0 +1,94 @@
+# grid.py
+# Tile occupancy grid: one byte of flags per map cell, so "what is at (x, y)"
+# is a single index instead of a scan over every object.
+import math
+
+WALL = 1
+LOCKED_DOOR = 2
+KEY = 4
+BLOCKING = WALL | LOCKED_DOOR
+
+# Map letter -> flags, for translating a whole row at once
+TILE_FLAGS = bytes(WALL if chr(i) == "B" else LOCKED_DOOR if chr(i) in "DEFZ" else KEY if chr(i) in "KYGX" else 0
+                   for i in range(256))
+
+class OccupancyGrid:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.cells = bytearray(width * height)
+
+    @classmethod
+    def from_tile_map(cls, rows):
+        grid = cls(max(len(row) for row in rows), len(rows))
+        for y, row in enumerate(rows):
+            start = y * grid.width
+            grid.cells[start:start + len(row)] = row.encode("ascii", "replace").translate(TILE_FLAGS)
+        return grid
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def flags(self, x, y):
+        if not self.in_bounds(x, y):
+            return WALL  # Everything outside the map is solid
+        return self.cells[y * self.width + x]
+
+    def add(self, x, y, flag):
+        if self.in_bounds(x, y):
+            self.cells[y * self.width + x] |= flag
+
+    def remove(self, x, y, flag):
+        if self.in_bounds(x, y):
+            self.cells[y * self.width + x] &= ~flag
+
+    def is_blocked(self, x, y):
+        return bool(self.flags(x, y) & BLOCKING)
+
+    # True if a one-tile body at fractional tile position (x, y) overlaps anything solid
+    # A player between two tiles covers at most four cells
+    def is_area_blocked(self, x, y):
+        left, top = math.floor(x), math.floor(y)
+        right, bottom = math.ceil(x), math.ceil(y)
+        return (self.is_blocked(left, top) or self.is_blocked(right, top)
+                or self.is_blocked(left, bottom) or self.is_blocked(right, bottom))
+
+
+# Same queries over a memory-mapped map file (see mapfile.py). Walls are read
+# from the file when asked for; only doors and keys, which change during a
+# match, are kept in memory, so a huge map doesn't need a byte per cell.
+class MappedGrid(OccupancyGrid):
+    def __init__(self, map_file):
+        self.map_file = map_file
+        self.width = map_file.width
+        self.height = map_file.height
+        self.dynamic = {}  # (x, y) -> flags of doors and keys
+
+    @classmethod
+    def from_map_file(cls, map_file):
+        grid = cls(map_file)
+        for x, y, tile in map_file.objects:
+            if tile in ["D", "E", "F", "Z"]:
+                grid.add(x, y, LOCKED_DOOR)
+            elif tile in ["K", "Y", "G", "X"]:
+                grid.add(x, y, KEY)
+        return grid
+
+    def flags(self, x, y):
+        if not self.in_bounds(x, y):
+            return WALL
+        flags = self.dynamic.get((x, y), 0)
+        if self.map_file.tile(x, y) == "B":
+            flags |= WALL
+        return flags
+
+    def add(self, x, y, flag):
+        if self.in_bounds(x, y):
+            self.dynamic[(x, y)] = self.dynamic.get((x, y), 0) | flag
+
+    def remove(self, x, y, flag):
+        flags = self.dynamic.get((x, y), 0) & ~flag
+        if flags:
+            self.dynamic[(x, y)] = flags
+        else:
+            self.dynamic.pop((x, y), None)
@@ -0,0 +1,53 @@
+# interest.py
+# Spatial hash of player positions for area-of-interest filtering. Players are
+# bucketed into square cells the size of the interest radius, so finding who is
+# near someone only looks at the 3x3 cells around them instead of every player.
+import math
+
+class SpatialHash:
+    def __init__(self, cell_size):
+        self.cell_size = max(1, cell_size)
+        self.cells = {}   # (cell x, cell y) -> set of player names
+        self.points = {}  # player name -> (x, y, cell)
+
+    def cell_of(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    # Adds the player, or moves it if it is already in the hash
+    def move(self, name, x, y):
+        cell = self.cell_of(x, y)
+        old = self.points.get(name)
+        if old is not None and old[2] != cell:
+            self.discard_from_cell(name, old[2])
+        if old is None or old[2] != cell:
+            self.cells.setdefault(cell, set()).add(name)
+        self.points[name] = (x, y, cell)
+
+    def remove(self, name):
+        old = self.points.pop(name, None)
+        if old is not None:
+            self.discard_from_cell(name, old[2])
+
+    def discard_from_cell(self, name, cell):
+        names = self.cells.get(cell)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.points.clear()
+
+    # Names of every player at most radius tiles away on both axes, a square like the screen
+    def nearby(self, x, y, radius):
+        cx, cy = self.cell_of(x, y)
+        reach = math.ceil(radius / self.cell_size)
+        found = set()
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for name in self.cells.get((gx, gy), ()):
+                    px, py, _ = self.points[name]
+                    if abs(px - x) <= radius and abs(py - y) <= radius:
+                        found.add(name)
+        return found
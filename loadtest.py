@@ -0,0 +1,422 @@
+# loadtest.py
+# Headless load generator. Opens many bot connections that speak the same
+# protocol as client.py (join, moves, pickup, unlock, delete_key, acks) and
+# reports broadcast latency, message and byte rates, and server CPU.
+#
+#   python loadtest.py --bots 200 --duration 30
+#   python loadtest.py --bots 500 --server "--mode thread" --server "--mode async" --server "--workers 4"
+#
+# With --server the script starts server.py itself, once per argument string,
+# and runs the same scenario against each so the modes can be compared.
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import socket
+import subprocess
+import sys
+import time
+import protocol
+from config import tile_map, recv_buffer_size
+from framing import FrameReader
+from grid import OccupancyGrid, MappedGrid
+from mapfile import open_map
+from tilemap import map_hash
+
+HOST = "127.0.0.1"
+PORT = 5555
+
+class Stats:
+    def __init__(self):
+        self.latencies = []      # Seconds from a move being sent to a bot seeing it in sync_positions
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.received_messages = 0
+        self.received_bytes = 0
+        self.connected = 0
+        self.failed = 0
+        self.disconnected = 0
+        self.recording = False   # Only count traffic once every bot has joined
+        self.pending = {}        # player name -> (position, time the move was sent)
+
+    def reset(self):
+        self.latencies.clear()
+        self.sent_messages = self.sent_bytes = 0
+        self.received_messages = self.received_bytes = 0
+
+
+class Bot:
+    def __init__(self, name, stats, args):
+        self.name = name
+        self.stats = stats
+        self.args = args
+        self.writer = None
+        self.wire_protocol = "json"
+        self.player_ids = {}
+        self.player_names = {}
+        self.home = None         # Spawn tile, the bot walks between here and one free neighbour
+        self.away = None
+        self.at_home = True
+        self.objects = {}        # Doors and keys, kept up to date like client.py does
+        self.objects_version = 0
+        self.last_seen = {}      # player name -> last position this bot saw for it
+
+    async def run(self, grid, stop):
+        try:
+            reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        except OSError:
+            self.stats.failed += 1
+            return
+        self.stats.connected += 1
+        join_msg = {
+            "type": "join",
+            "player": self.name,
+            "map_hashes": [map_hash(tile_map)],
+            "protocols": ["binary", "json"] if self.args.protocol == "binary" else ["json"],
+        }
+        if self.args.room:
+            join_msg["room"] = self.args.room
+        if self.args.compress:
+            join_msg["protocols"].insert(1, protocol.COMPRESSION)
+        self.send(join_msg)
+        receiver = asyncio.create_task(self.receive(reader, grid))
+        try:
+            await self.play(stop)
+        finally:
+            receiver.cancel()
+            self.writer.close()
+
+    def send(self, message):
+        data = protocol.encode(message, self.wire_protocol, self.player_ids)
+        self.writer.write(data)
+        if self.stats.recording:
+            self.stats.sent_messages += 1
+            self.stats.sent_bytes += len(data)
+
+    # Scripted traffic: moves at move_rate, object actions at action_rate
+    async def play(self, stop):
+        next_move = time.monotonic() + random.random() / self.args.move_rate
+        next_action = time.monotonic() + random.expovariate(self.args.action_rate) if self.args.action_rate > 0 else None
+        while not stop.is_set():
+            now = time.monotonic()
+            if self.away is not None and now >= next_move:
+                self.move()
+                next_move += 1 / self.args.move_rate
+            if next_action is not None and now >= next_action:
+                self.act()
+                next_action = now + random.expovariate(self.args.action_rate)
+            wake = next_move if next_action is None else min(next_move, next_action)
+            try:
+                await asyncio.wait_for(stop.wait(), max(0.001, wake - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    def move(self):
+        self.at_home = not self.at_home
+        position = self.home if self.at_home else self.away
+        self.stats.pending[self.name] = (position, time.perf_counter())
+        self.send({"type": "move", "player": self.name, "position": list(position), "sprite_counter": None})
+
+    def act(self):
+        keys = [obj for obj in self.objects.values() if obj.get("type") == "key"]
+        doors = [obj for obj in self.objects.values() if obj.get("type") == "door" and obj.get("locked")]
+        roll = random.random()
+        if roll < 0.6 and keys:
+            key = random.choice(keys)
+            self.send({"type": "pickup", "player": self.name, "possessed_by": self.name,
+                       "object_id": key["id"], "position": [key["x"], key["y"]]})
+        elif roll < 0.8 and doors:
+            self.send({"type": "unlock", "player": self.name, "object_id": random.choice(doors)["id"]})
+        else:
+            mine = [key for key in keys if key.get("possessed_by") == self.name]
+            if mine:
+                self.send({"type": "delete_key", "player": self.name, "object_id": random.choice(mine)["id"]})
+
+    async def receive(self, reader, grid):
+        frames = FrameReader()
+        frames.enable_compression()
+        while True:
+            data = await reader.read(recv_buffer_size)
+            if not data:
+                self.stats.disconnected += 1
+                return
+            frames.feed(data)
+            messages = frames.messages()
+            if self.stats.recording:
+                self.stats.received_messages += len(messages)
+                self.stats.received_bytes += len(data)
+            for msg_type, payload in messages:
+                try:
+                    self.handle(protocol.decode(msg_type, payload, self.player_names), grid)
+                except (ValueError, KeyError):
+                    continue
+
+    def handle(self, message_dict, grid):
+        msg_type = message_dict.get("type")
+        if msg_type == "sync_positions":
+            self.seen_positions(message_dict["players"])
+            own = message_dict["players"].get(self.name)
+            if self.home is None and own is not None:
+                self.home = (round(own["x"]), round(own["y"]))
+                self.away = free_neighbour(grid, self.home)
+        elif msg_type == "visibility":
+            self.seen_positions(message_dict["entered"])
+        elif msg_type == "welcome":
+            self.wire_protocol = message_dict["protocol"]
+        elif msg_type == "player_ids":
+            self.player_ids = message_dict["players"]
+            self.player_names = {entity_id: name for name, entity_id in self.player_ids.items()}
+        elif msg_type == "sync_objects":
+            self.objects = dict(message_dict["objects"])
+            if "version" in message_dict:
+                self.objects_version = message_dict["version"]
+                self.send({"type": "ack", "version": self.objects_version})
+        elif msg_type == "sync_delta":
+            if message_dict["base"] > self.objects_version:
+                self.send({"type": "resync"})
+                return
+            self.objects.update(message_dict["added"])
+            self.objects.update(message_dict["changed"])
+            for object_id in message_dict["removed"]:
+                self.objects.pop(object_id, None)
+            self.objects_version = message_dict["version"]
+            self.send({"type": "ack", "version": self.objects_version})
+
+    # A sample is the time from the move being sent until this bot first sees the new position
+    def seen_positions(self, players):
+        now = time.perf_counter()
+        for name, pos in players.items():
+            position = (round(pos["x"], 2), round(pos["y"], 2))
+            if self.last_seen.get(name) == position:
+                continue
+            self.last_seen[name] = position
+            pending = self.stats.pending.get(name)
+            if self.stats.recording and pending is not None and pending[0] == position:
+                self.stats.latencies.append(now - pending[1])
+
+
+# An open tile next to the spawn point, so every scripted move is one the server accepts
+def free_neighbour(grid, tile):
+    x, y = tile
+    for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+        if not grid.is_blocked(x + dx, y + dy):
+            return (x + dx, y + dy)
+    return tile  # Boxed in, the bot just re-sends its own position
+
+
+# CPU seconds used by a process and all its children (sharded workers), None if it can't be read
+def cpu_seconds(pid):
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            total = 0.0
+            for p in [process] + process.children(recursive=True):
+                times = p.cpu_times()
+                total += times.user + times.system
+            return total
+        except psutil.Error:
+            return None
+    if not os.path.isdir("/proc"):
+        return None
+    # No psutil, read /proc directly (Linux)
+    parents = {}
+    ticks = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields[1])
+        ticks[int(entry)] = int(fields[11]) + int(fields[12])  # utime + stime
+    if pid not in ticks:
+        return None
+    family = {pid}
+    changed = True
+    while changed:
+        changed = False
+        for child, parent in parents.items():
+            if parent in family and child not in family:
+                family.add(child)
+                changed = True
+    return sum(ticks[p] for p in family) / os.sysconf("SC_CLK_TCK")
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+# Runs one scenario against the server at host:port and returns the results as a dict
+async def run_load(args, server_pid=None):
+    stats = Stats()
+    if args.map_file:
+        grid = MappedGrid.from_map_file(open_map(args.map_file))
+    else:
+        grid = OccupancyGrid.from_tile_map(tile_map)
+    stop = asyncio.Event()
+    tasks = []
+    for i in range(args.bots):
+        bot = Bot(f"bot{i}", stats, args)
+        tasks.append(asyncio.create_task(bot.run(grid, stop)))
+        if args.ramp > 0:
+            await asyncio.sleep(args.ramp / args.bots)
+    await asyncio.sleep(args.warmup)
+
+    stats.reset()
+    stats.recording = True
+    cpu_start = cpu_seconds(server_pid) if server_pid else None
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    cpu_end = cpu_seconds(server_pid) if server_pid else None
+    stats.recording = False
+
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies = sorted(stats.latencies)
+    def ms(value):
+        return None if value is None else round(value * 1000, 2)
+    return {
+        "bots": args.bots,
+        "connected": stats.connected,
+        "failed": stats.failed,
+        "dropped": stats.disconnected,
+        "duration": round(elapsed, 2),
+        "latency_samples": len(latencies),
+        "latency_p50_ms": ms(percentile(latencies, 0.50)),
+        "latency_p90_ms": ms(percentile(latencies, 0.90)),
+        "latency_p99_ms": ms(percentile(latencies, 0.99)),
+        "latency_max_ms": ms(latencies[-1] if latencies else None),
+        "sent_msgs_per_s": round(stats.sent_messages / elapsed, 1),
+        "sent_bytes_per_s": round(stats.sent_bytes / elapsed, 1),
+        "received_msgs_per_s": round(stats.received_messages / elapsed, 1),
+        "received_bytes_per_s": round(stats.received_bytes / elapsed, 1),
+        "server_cpu_percent": None if cpu_start is None or cpu_end is None
+                              else round(100 * (cpu_end - cpu_start) / elapsed, 1),
+    }
+
+# Starts server.py with the given arguments and waits until it accepts connections
+def start_server(server_args, host, port):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py")]
+    command += shlex.split(server_args)
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            # Cold start: interpreter, imports and setup until the first connection is accepted
+            return process, round((time.perf_counter() - started) * 1000, 1)
+        except OSError:
+            time.sleep(0.005)
+    process.kill()
+    raise RuntimeError("server did not start listening")
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(5)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def print_result(label, result):
+    print(f"[LOAD] {label}: {result['connected']}/{result['bots']} bots connected, "
+          f"{result['failed']} failed, {result['dropped']} dropped by the server")
+    print(f"  latency ms    p50 {result['latency_p50_ms']}  p90 {result['latency_p90_ms']}  "
+          f"p99 {result['latency_p99_ms']}  max {result['latency_max_ms']}  ({result['latency_samples']} samples)")
+    print(f"  sent          {result['sent_msgs_per_s']} msg/s  {result['sent_bytes_per_s'] / 1024:.1f} KiB/s")
+    print(f"  received      {result['received_msgs_per_s']} msg/s  {result['received_bytes_per_s'] / 1024:.1f} KiB/s")
+    cpu = result["server_cpu_percent"]
+    print(f"  server cpu    {'n/a' if cpu is None else f'{cpu}%'}")
+    if result.get("server_startup_ms") is not None:
+        print(f"  server start  {result['server_startup_ms']} ms until accepting connections")
+
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless bot swarm for load testing server.py")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--bots", type=int, default=50, help="concurrent bot connections")
+    parser.add_argument("--duration", type=float, default=20, help="seconds measured after warmup")
+    parser.add_argument("--ramp", type=float, default=2, help="seconds over which bots connect")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds after the last join before measuring")
+    parser.add_argument("--move-rate", type=float, default=8, help="moves per second per bot")
+    parser.add_argument("--action-rate", type=float, default=0.2,
+                        help="pickup/unlock/delete_key actions per second per bot")
+    parser.add_argument("--protocol", choices=["binary", "json"], default="binary")
+    parser.add_argument("--compress", action="store_true", help="ask for compression, binary protocol only")
+    parser.add_argument("--room", default=None, help="put every bot in this room instead of matchmaking")
+    parser.add_argument("--map-file", default=None, help="map file the server plays, so bots know where the walls are")
+    parser.add_argument("--server", action="append", default=[], metavar="ARGS",
+                        help='start server.py with these arguments, e.g. "--mode async"; repeat to compare modes')
+    parser.add_argument("--server-pid", type=int, default=None, help="pid of an already running server, for CPU usage")
+    parser.add_argument("--json", default=None, metavar="PATH", help="also write the results to this file")
+    parser.add_argument("--max-p99", type=float, default=None, metavar="MS",
+                        help="exit with status 1 if p99 latency is above this, or any bot failed, for CI")
+    parser.add_argument("--max-startup", type=float, default=None, metavar="MS",
+                        help="exit with status 1 if a started server took longer than this to accept connections")
+    args = parser.parse_args()
+    if args.move_rate <= 0:
+        parser.error("--move-rate must be positive")
+    raise_fd_limit()
+
+    results = {}
+    if args.server:
+        for server_args in args.server:
+            process, startup_ms = start_server(server_args, args.host, args.port)
+            try:
+                results[server_args] = asyncio.run(run_load(args, process.pid))
+                results[server_args]["server_startup_ms"] = startup_ms
+            finally:
+                time.sleep(0.5)  # Let the bots' sockets close first so the port is free for the next run
+                stop_server(process)
+            print_result(server_args, results[server_args])
+    else:
+        label = f"{args.host}:{args.port}"
+        results[label] = asyncio.run(run_load(args, args.server_pid))
+        print_result(label, results[label])
+
+    if len(results) > 1:
+        print()
+        print(f"{'server':<24}{'p50 ms':>9}{'p99 ms':>9}{'recv msg/s':>12}{'cpu %':>8}")
+        for label, result in results.items():
+            print(f"{label:<24}{str(result['latency_p50_ms']):>9}{str(result['latency_p99_ms']):>9}"
+                  f"{result['received_msgs_per_s']:>12}{str(result['server_cpu_percent']):>8}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.max_p99 is not None:
+        for result in results.values():
+            p99 = result["latency_p99_ms"]
+            if result["failed"] or p99 is None or p99 > args.max_p99:
+                sys.exit(1)
+    if args.max_startup is not None:
+        for result in results.values():
+            if result.get("server_startup_ms") is not None and result["server_startup_ms"] > args.max_startup:
+                sys.exit(1)
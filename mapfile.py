@@ -0,0 +1,137 @@
+# mapfile.py
+# Binary map format for maps too big to keep as a list of strings. The server
+# memory-maps the file and only reads the chunks and tiles it is asked for,
+# so opening a 1000x1000 map costs about as much as opening the bundled one.
+#
+# Layout, all numbers big-endian:
+#   header   magic "CMAP" | version (1 byte) | chunk size (2 bytes) | width (4 bytes)
+#            | height (4 bytes) | object count (4 bytes) | map hash (16 ASCII bytes)
+#   chunks   one byte per tile, chunk_size * chunk_size tiles per chunk, row by row
+#            inside a chunk and chunks row by row across the map. Tiles past the
+#            right or bottom edge are " " (nothing)
+#   objects  object count * (x, y, tile), every door, key and spawn tile in row
+#            order, so they can be set up without reading the chunks
+#
+# Maps are at most protocol.MAX_MAP_SIZE tiles wide and tall, the range binary
+# positions cover.
+#
+# The map hash is tilemap.map_hash of the rows, the same as for config.tile_map,
+# so a client that has the map cached by hash does not download it again.
+#
+# Convert a tile_map into this format with:
+#   python mapfile.py --out map.cmap                       # config.tile_map
+#   python mapfile.py --rows big_map.txt --out big.cmap    # one row of tiles per line
+import argparse
+import functools
+import mmap
+import struct
+from tilemap import map_hash, encode_rows
+from protocol import MAX_MAP_SIZE
+
+MAGIC = b"CMAP"
+VERSION = 1
+HEADER = struct.Struct("!4sBHIII16s")
+OBJECT = struct.Struct("!IIc")
+DEFAULT_CHUNK_SIZE = 32
+
+# Tiles listed in the object table
+OBJECT_TILES = "DEFZKYGXP"
+
+class MapFile:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.chunk_size, self.width, self.height, object_count, hash_ = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} map file")
+        check_size(self.width, self.height)
+        self.hash = hash_.decode("ascii")
+        self.chunks_x = -(-self.width // self.chunk_size)
+        self.chunks_y = -(-self.height // self.chunk_size)
+        self.chunk_bytes = self.chunk_size * self.chunk_size
+        objects_start = HEADER.size + self.chunks_x * self.chunks_y * self.chunk_bytes
+        self.objects = [(x, y, tile.decode("ascii"))
+                        for x, y, tile in OBJECT.iter_unpack(self.data[objects_start:objects_start + object_count * OBJECT.size])]
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    # Tile letter at (x, y), read straight from the mapped file
+    def tile(self, x, y):
+        if not self.in_bounds(x, y):
+            return " "
+        cx, tx = divmod(x, self.chunk_size)
+        cy, ty = divmod(y, self.chunk_size)
+        offset = HEADER.size + (cy * self.chunks_x + cx) * self.chunk_bytes + ty * self.chunk_size + tx
+        return chr(self.data[offset])
+
+    def has_chunk(self, cx, cy):
+        return 0 <= cx < self.chunks_x and 0 <= cy < self.chunks_y
+
+    # Rows of one chunk as strings, cut off at the map edge
+    def chunk_rows(self, cx, cy):
+        start = HEADER.size + (cy * self.chunks_x + cx) * self.chunk_bytes
+        width = min(self.chunk_size, self.width - cx * self.chunk_size)
+        height = min(self.chunk_size, self.height - cy * self.chunk_size)
+        return [self.data[start + row * self.chunk_size:start + row * self.chunk_size + width].decode("ascii")
+                for row in range(height)]
+
+    # Run-length encoded chunk rows as sent to clients, recently sent chunks are kept
+    @functools.lru_cache(maxsize=1024)
+    def encoded_chunk(self, cx, cy):
+        return encode_rows(self.chunk_rows(cx, cy))
+
+    def close(self):
+        self.data.close()
+
+
+_open_maps = {}  # path -> MapFile, every room of the process shares one mapping
+
+def open_map(path):
+    map_file = _open_maps.get(path)
+    if map_file is None:
+        map_file = _open_maps[path] = MapFile(path)
+    return map_file
+
+# Player positions past MAX_MAP_SIZE can't be sent, so such a map could never be played
+def check_size(width, height):
+    if width > MAX_MAP_SIZE or height > MAX_MAP_SIZE:
+        raise ValueError(f"map of {width}x{height} tiles is over the {MAX_MAP_SIZE}x{MAX_MAP_SIZE} limit")
+
+def write_map_file(path, rows, chunk_size=DEFAULT_CHUNK_SIZE):
+    width = max(len(row) for row in rows)
+    height = len(rows)
+    check_size(width, height)
+    chunks_x = -(-width // chunk_size)
+    chunks_y = -(-height // chunk_size)
+    objects = [(x, y, tile) for y, row in enumerate(rows) for x, tile in enumerate(row) if tile in OBJECT_TILES]
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, chunk_size, width, height, len(objects), map_hash(rows).encode("ascii")))
+        for cy in range(chunks_y):
+            for cx in range(chunks_x):
+                for y in range(cy * chunk_size, (cy + 1) * chunk_size):
+                    row = rows[y] if y < height else ""
+                    f.write(row[cx * chunk_size:(cx + 1) * chunk_size].ljust(chunk_size).encode("ascii"))
+        for x, y, tile in objects:
+            f.write(OBJECT.pack(x, y, tile.encode("ascii")))
+    return len(objects)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a tile_map into a chunked binary map file")
+    parser.add_argument("--rows", default=None, help="text file with one row of tiles per line, default config.tile_map")
+    parser.add_argument("--out", required=True, help="map file to write, e.g. map.cmap")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="tiles per chunk side")
+    args = parser.parse_args()
+    if args.rows:
+        with open(args.rows) as f:
+            rows = [line.rstrip("\r\n") for line in f]
+        while rows and not rows[-1]:
+            rows.pop()
+    else:
+        from config import tile_map
+        rows = list(tile_map)
+    count = write_map_file(args.out, rows, args.chunk_size)
+    map_file = MapFile(args.out)
+    print(f"[+] Wrote {args.out}: {map_file.width}x{map_file.height} tiles, "
+          f"{map_file.chunks_x}x{map_file.chunks_y} chunks of {map_file.chunk_size}, {count} objects, hash {map_file.hash}")
@@ -22,10 +22,6 @@ def handle_tile_movement(player, keys):
         #print("[DEBUG] S pressed - move down")
 #acceleration to determine collision
     if dx != 0 or dy != 0:
-        for sprite in player.game.blocks:
-            if hasattr(sprite, "try_unlock"):
-                sprite.try_unlock(player, dx * tile_size, dy * tile_size)
-
         target_x = player.rect.x + dx * tile_size
         target_y = player.rect.y + dy * tile_size
         #print(f"[DEBUG] Target position: ({target_x}, {target_y})")
@@ -35,10 +31,15 @@ def handle_tile_movement(player, keys):
         future_rect.y = target_y
 
         #print(f"[DEBUG] Current tile: ({player.rect.x // tile_size}, {player.rect.y // tile_size})")
-        
 
-        for wall in player.game.blocks:
-            if future_rect.colliderect(wall.rect):
+        # Only the tiles under the target matter, looked up by cell instead of checking every wall
+        # A player standing on whole tiles always steps into exactly one cell
+        for sprite in player.game.tiles.in_area(future_rect):
+            if hasattr(sprite, "try_unlock"):
+                sprite.try_unlock(player, dx * tile_size, dy * tile_size)
+
+        for wall in player.game.tiles.in_area(future_rect):  # Looked up again, an unlocked door is gone by now
+            if player.game.blocks.has(wall):
                 #print("[DEBUG] Movement blocked by wall.")
                 return
 
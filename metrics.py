@@ -0,0 +1,150 @@
+# metrics.py
+# Always-on server instrumentation: counters, latency histograms and gauges.
+# Recording is a dict update and a bisect under an uncontended lock, so it is
+# cheap enough to leave on. snapshot() turns everything into plain JSON that
+# serve_http() and start_dump() expose for charting.
+import bisect
+import json
+import os
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+# Histogram bucket upper bounds in seconds: 1 us doubling up to about 8 s
+BUCKET_BOUNDS = [0.000001 * 2 ** i for i in range(24)]
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKET_BOUNDS) + 1)  # Last bucket catches everything slower
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    # Upper bound of the bucket holding the given fraction of samples
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target and n:
+                return min(BUCKET_BOUNDS[i], self.max) if i < len(BUCKET_BOUNDS) else self.max
+        return self.max
+
+    def summary(self):
+        def ms(seconds):
+            return round(seconds * 1000, 3)
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.total / self.count) if self.count else 0,
+            "p50_ms": ms(self.percentile(0.50)),
+            "p90_ms": ms(self.percentile(0.90)),
+            "p99_ms": ms(self.percentile(0.99)),
+            "max_ms": ms(self.max),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.counters = defaultdict(int)   # name -> count
+        self.histograms = defaultdict(Histogram)  # name -> Histogram
+        self.gauges = {}                   # name -> function returning the current value
+        self.connections = weakref.WeakSet()  # Live Connection objects, for per-client bytes and queue depth
+        self.lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.histograms[name].observe(seconds)
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def add_connection(self, conn):
+        with self.lock:
+            self.connections.add(conn)
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: h.summary() for name, h in self.histograms.items()}
+            connections = list(self.connections)
+        gauges = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                gauges[name] = read()
+            except Exception as e:
+                gauges[name] = None
+                print(f"[!] Gauge {name} failed: {e}")
+        clients = []
+        for conn in connections:
+            if conn.closed:
+                continue
+            clients.append({
+                "addr": str(conn.addr),
+                "bytes_in": conn.bytes_in,
+                "bytes_out": conn.bytes_out,
+                "queued_messages": len(conn.queue),
+                "queued_bytes": conn.queued_bytes,
+            })
+        gauges["connections"] = len(clients)
+        gauges["queued_bytes_total"] = sum(c["queued_bytes"] for c in clients)
+        gauges["queued_bytes_max"] = max((c["queued_bytes"] for c in clients), default=0)
+        return {
+            "time": time.time(),
+            "uptime": round(time.time() - self.started, 1),
+            "counters": counters,
+            "histograms": histograms,
+            "gauges": gauges,
+            "clients": clients,
+        }
+
+    # Serves the snapshot as JSON on http://host:port/ from a background thread
+    def serve_http(self, host, port):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Only servers started with --stats-port pay for it
+        metrics = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Polled every few seconds, don't flood the server log
+
+        server = ThreadingHTTPServer((host, port), StatsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"[SERVER] Stats on http://{host}:{port}/")
+
+    # Rewrites path with a fresh snapshot every interval seconds
+    def start_dump(self, path, interval):
+        def dump_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    temp_path = path + ".tmp"
+                    with open(temp_path, "w") as f:
+                        json.dump(self.snapshot(), f)
+                    os.replace(temp_path, path)  # Readers never see a half-written file
+                except OSError as e:
+                    print(f"[!] Could not write stats: {e}")
+        threading.Thread(target=dump_loop, daemon=True).start()
+
+
+metrics = Metrics()  # Shared by every module of the process
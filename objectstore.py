@@ -0,0 +1,174 @@
+# objectstore.py
+# Server-side game objects kept as parallel typed arrays indexed by an integer
+# id, instead of one dict per object. A wall costs about 20 bytes here against
+# several hundred as a dict, which is what lets big maps fit. Objects only turn
+# into the dicts clients know ({"id": "door3", "type": "door", ...}) when they
+# are sent or logged, through wire() and wire_object().
+#
+# The wire id of an object is its kind and its number within that kind, e.g.
+# "key2", numbered in map order exactly like tilemap.expand_tile_map does.
+import re
+from array import array
+from itertools import compress
+from tilemap import color_map
+
+KINDS = ["wall", "floor", "door", "key"]
+WALL, FLOOR, DOOR, KEY = range(len(KINDS))
+KIND_INDEX = {kind: i for i, kind in enumerate(KINDS)}
+COLORS = [None, "red", "green", "orange", "maroon"]
+COLOR_INDEX = {color: i for i, color in enumerate(COLORS)}
+NO_OWNER = -1
+
+# Map letters of doors and keys
+DOOR_TILES = "DEFZ"
+KEY_TILES = "KYGX"
+FLOOR_TILES = ".PKYGX"  # Tiles drawn with a floor under them
+SPECIAL_TILE = re.compile("[DEFZKYGXP]")
+
+class ObjectStore:
+    def __init__(self):
+        self.kind = array("B")
+        self.number = array("I")   # Number within the kind, the digits of the wire id
+        self.x = array("i")
+        self.y = array("i")
+        self.color = array("B")    # Index into COLORS
+        self.locked = array("B")
+        self.owner = array("i")    # Index into owner_names, NO_OWNER if nobody holds it
+        self.alive = array("B")    # 0 once removed, indexes are never reused within a match
+        self.by_number = [array("i") for _ in KINDS]  # kind -> number -> index
+        self.owner_names = []      # Player names that ever held something, looked up by owner
+        self.owner_index = {}      # player name -> index into owner_names
+        self.live = 0
+
+    def __len__(self):
+        return self.live
+
+    def __contains__(self, object_id):
+        return self.index_of(object_id) is not None
+
+    def add(self, kind, x, y, color=None, locked=False):
+        index = len(self.kind)
+        self.kind.append(kind)
+        self.number.append(len(self.by_number[kind]))
+        self.by_number[kind].append(index)
+        self.x.append(x)
+        self.y.append(y)
+        self.color.append(COLOR_INDEX[color])
+        self.locked.append(1 if locked else 0)
+        self.owner.append(NO_OWNER)
+        self.alive.append(1)
+        self.live += 1
+        return index
+
+    # Adds one object of the given kind at each x of xs on row y, for building big maps quickly
+    def add_row(self, kind, xs, y):
+        count = len(xs)
+        if not count:
+            return
+        index = len(self.kind)
+        numbers = self.by_number[kind]
+        self.kind.frombytes(bytes([kind]) * count)
+        self.number.fromlist(list(range(len(numbers), len(numbers) + count)))
+        numbers.fromlist(list(range(index, index + count)))
+        self.x.fromlist(xs)
+        self.y.fromlist([y] * count)
+        self.color.frombytes(bytes(count))
+        self.locked.frombytes(bytes(count))
+        self.owner.fromlist([NO_OWNER] * count)
+        self.alive.frombytes(b"\x01" * count)
+        self.live += count
+
+    # Index of a live object from its wire id, or None
+    def index_of(self, object_id):
+        if not isinstance(object_id, str):
+            return None
+        digits = len(object_id)
+        while digits and "0" <= object_id[digits - 1] <= "9":  # Not isdigit(), int() refuses digits like "²"
+            digits -= 1
+        kind = KIND_INDEX.get(object_id[:digits])
+        if kind is None or digits == len(object_id):
+            return None
+        number = int(object_id[digits:])
+        numbers = self.by_number[kind]
+        if number >= len(numbers) or not self.alive[numbers[number]]:
+            return None
+        return numbers[number]
+
+    def object_id(self, index):
+        return KINDS[self.kind[index]] + str(self.number[index])
+
+    def remove(self, index):
+        if self.alive[index]:
+            self.alive[index] = 0
+            self.live -= 1
+
+    def owner_of(self, index):
+        owner = self.owner[index]
+        return None if owner == NO_OWNER else self.owner_names[owner]
+
+    def set_owner(self, index, name):
+        if name is None:
+            self.owner[index] = NO_OWNER
+            return
+        owner = self.owner_index.get(name)
+        if owner is None:
+            owner = self.owner_index[name] = len(self.owner_names)
+            self.owner_names.append(name)
+        self.owner[index] = owner
+
+    # Indexes of the live objects the player holds
+    def owned_by(self, name):
+        owner = self.owner_index.get(name)
+        if owner is None:
+            return []
+        return [i for i, held in enumerate(self.owner) if held == owner and self.alive[i]]
+
+    # The object as clients and the event log know it
+    def wire_object(self, index):
+        kind = self.kind[index]
+        obj = {"id": self.object_id(index), "type": KINDS[kind], "x": self.x[index], "y": self.y[index]}
+        if kind == DOOR:
+            obj["color"] = COLORS[self.color[index]]
+            obj["locked"] = bool(self.locked[index])
+        elif kind == KEY:
+            obj["color"] = COLORS[self.color[index]]
+            obj["possessed_by"] = self.owner_of(index)
+        return obj
+
+    # Same as wire_object, or None if the id names no live object
+    def get(self, object_id):
+        index = self.index_of(object_id)
+        return None if index is None else self.wire_object(index)
+
+    # Every live object as {wire id: object}, for full snapshots
+    def wire(self):
+        return {self.object_id(i): self.wire_object(i) for i in range(len(self.kind)) if self.alive[i]}
+
+
+# Walls and floors of a tile_map, same objects and ids as tilemap.expand_tile_map
+# Whole rows at a time, without a Python loop per tile
+def store_walls_and_floors(rows):
+    static_objects = ObjectStore()
+    for y, row in enumerate(rows):
+        columns = range(len(row))
+        static_objects.add_row(WALL, list(compress(columns, map("B".__eq__, row))), y)
+        static_objects.add_row(FLOOR, list(compress(columns, map(FLOOR_TILES.__contains__, row))), y)
+    return static_objects
+
+# Doors, keys and spawn points of a tile_map: (ObjectStore, spawn points)
+def store_special_tiles(rows):
+    return store_object_tiles((match.start(), y, match.group())
+                              for y, row in enumerate(rows) for match in SPECIAL_TILE.finditer(row))
+
+# Doors, keys and spawn points from (x, y, tile) in map order, e.g. the table of a map file (see mapfile.py)
+def store_object_tiles(tiles):
+    objects = ObjectStore()
+    spawn_points = []
+    for x, y, tile in tiles:
+        if tile in DOOR_TILES:
+            objects.add(DOOR, x, y, color_map[tile], locked=True)
+        elif tile in KEY_TILES:
+            objects.add(KEY, x, y, color_map[tile])
+        elif tile == "P":
+            spawn_points.append((x, y))
+    return objects, spawn_points
@@ -0,0 +1,183 @@
+# protocol.py
+# Wire formats shared by the server and the client.
+#
+# Every connection starts with newline-terminated JSON. A client that lists
+# "binary" in the "protocols" field of its join gets length-prefixed frames
+# back and may send them itself. Both formats can be read from the same
+# stream, frames start with FRAME_MAGIC which never starts a JSON line.
+# framing.FrameReader splits a received stream back into messages.
+#
+# Frame layout: magic (1 byte) | message type (1 byte) | payload length (4 bytes) | payload
+#
+# A binary client that also lists COMPRESSION may get MSG_ZLIB frames. All of
+# them continue one deflate stream per connection, primed with
+# PRESET_DICTIONARY, so names and keys repeated across broadcasts cost a few
+# bits each after the first time.
+import json
+import struct
+import zlib
+
+FRAME_MAGIC = 0xFE  # Never appears in UTF-8 text
+HEADER = struct.Struct("!BBI")
+
+# Frame message types
+MSG_JSON = 0       # Payload is a UTF-8 JSON message, used for everything without a compact form
+MSG_MOVE = 1       # Payload is one PLAYER_STATE
+MSG_POSITIONS = 2  # Payload is a player count followed by that many PLAYER_STATE
+MSG_ZLIB = 3       # Payload is the next piece of the connection's deflate stream, holding whole messages
+
+# Entity id, x, y, sprite counter (-1 when unknown)
+PLAYER_STATE = struct.Struct("!HHHb")
+COUNT = struct.Struct("!H")
+MOVE_FRAME = struct.Struct("!BBI" + "HHHb")  # Header and one PLAYER_STATE, packed in one call
+
+# Position frames for n players, built on first use so each size is only compiled once
+_positions_frames = {}
+
+def positions_frame(count):
+    frame = _positions_frames.get(count)
+    if frame is None:
+        frame = _positions_frames[count] = struct.Struct("!BBIH" + "HHHb" * count)
+    return frame
+
+# Positions are sent as fixed point tile coordinates, 1/32 of a tile (one pixel)
+# steps, which covers maps up to 2047 tiles across
+POSITION_SCALE = 32
+MAX_MAP_SIZE = 0xFFFF // POSITION_SCALE  # Widest and tallest map, in tiles, positions can be sent on
+
+# UDP datagrams: magic (1 byte) | datagram type (1 byte) | sequence number (4 bytes) | payload
+# A HELLO carries the pairing token from the welcome message in place of the sequence number
+DATAGRAM_HEADER = struct.Struct("!BBI")
+DGRAM_HELLO = 1      # Client -> server to pair, echoed back as the acknowledgement
+DGRAM_MOVE = 2       # Payload is one PLAYER_STATE, like MSG_MOVE
+DGRAM_POSITIONS = 3  # Payload is the same as MSG_POSITIONS
+
+# Anything bigger goes over TCP instead, to stay clear of IP fragmentation
+MAX_DATAGRAM = 1200
+
+def encode_json(message):
+    return json.dumps(message).encode() + b"\n"
+
+def encode_frame(msg_type, payload):
+    return HEADER.pack(FRAME_MAGIC, msg_type, len(payload)) + payload
+
+# Largest sprite counter the signed byte of PLAYER_STATE holds
+MAX_SPRITE_COUNTER = 127
+
+def valid_sprite_counter(value):
+    return type(value) is int and 0 <= value <= MAX_SPRITE_COUNTER
+
+def quantize(value):
+    return max(0, min(0xFFFF, int(value * POSITION_SCALE + 0.5)))
+
+def unpack_position(x, y, sprite_counter):
+    if sprite_counter < 0:
+        return {"x": x / POSITION_SCALE, "y": y / POSITION_SCALE}
+    return {"x": x / POSITION_SCALE, "y": y / POSITION_SCALE, "sprite_counter": sprite_counter}
+
+# Encodes a message for a connection using the given protocol ("json" or "binary")
+# ids maps player names to the integer entity ids assigned at join
+def encode(message, protocol="json", ids=None):
+    if protocol != "binary":
+        return encode_json(message)
+    msg_type = message.get("type")
+    if msg_type == "move" and message.get("player") in ids:
+        x, y = message["position"]
+        sprite_counter = message.get("sprite_counter")
+        return MOVE_FRAME.pack(FRAME_MAGIC, MSG_MOVE, PLAYER_STATE.size, ids[message["player"]],
+                               quantize(x), quantize(y), sprite_counter if valid_sprite_counter(sprite_counter) else -1)
+    if msg_type == "sync_positions":
+        values = []
+        for name, pos in message["players"].items():
+            entity_id = ids.get(name)
+            if entity_id is None:
+                continue
+            sprite_counter = pos.get("sprite_counter")
+            if not (type(sprite_counter) is int and 0 <= sprite_counter <= MAX_SPRITE_COUNTER):
+                sprite_counter = -1  # Unknown, or a value the byte can't hold
+            # Inlined quantize(), this loop runs for every player on every tick
+            values += (entity_id, int(pos["x"] * POSITION_SCALE + 0.5), int(pos["y"] * POSITION_SCALE + 0.5),
+                       sprite_counter)
+        frame = positions_frame(len(values) // 4)
+        return frame.pack(FRAME_MAGIC, MSG_POSITIONS, frame.size - HEADER.size, len(values) // 4, *values)
+    return encode_frame(MSG_JSON, json.dumps(message).encode())
+
+# Wraps an already serialized JSON message (no trailing newline) for the given protocol
+def wrap_json(message_json, protocol="json"):
+    if protocol == "binary":
+        return encode_frame(MSG_JSON, message_json)
+    return message_json + b"\n"
+
+# Name of the compression in "protocols", must change whenever PRESET_DICTIONARY does
+COMPRESSION = "zlib1"
+
+# Messages shaped like what SyncManager sends, so the strings they repeat are
+# already known to the compressor before the first byte goes out
+def preset_dictionary():
+    objects = {}
+    for i, color in enumerate(("red", "green", "orange", "maroon")):
+        objects[f"door{i}"] = {"id": f"door{i}", "type": "door", "x": 10 + i, "y": 4, "color": color, "locked": True}
+        objects[f"key{i}"] = {"id": f"key{i}", "type": "key", "x": 2 + i, "y": 7, "color": color, "possessed_by": None}
+    player = {"x": 12.0, "y": 7.0, "sprite_counter": 1}
+    samples = [
+        {"type": "welcome", "protocol": "binary", "player_id": 1, "room": "room1", "match": "", "session": ""},
+        {"type": "static_map", "hash": "", "width": 25, "height": 25, "rows": ["25B", "B23.B"]},
+        {"type": "player_ids", "players": {"player1": 1, "player2": 2}},
+        {"type": "visibility", "entered": {"player1": player}, "left": ["player2"]},
+        {"type": "correction", "player": "player1", "position": [12.0, 7.0]},
+        {"type": "sync_objects", "version": 1, "objects": objects},
+        {"type": "sync_delta", "base": 1, "version": 2, "added": {},
+         "changed": {"key0": objects["key0"], "door0": dict(objects["door0"], locked=False)}, "removed": ["key1"]},
+    ]
+    # Deflate reaches the end of the dictionary with the shortest distances, so the most common go last
+    return b"".join(encode_frame(MSG_JSON, json.dumps(sample).encode()) for sample in samples)
+
+PRESET_DICTIONARY = preset_dictionary()
+
+# Raw deflate without the zlib header, both ends know the settings from the handshake
+def new_compressor(level=6):
+    return zlib.compressobj(level, zlib.DEFLATED, -15, zdict=PRESET_DICTIONARY)
+
+def new_decompressor():
+    return zlib.decompressobj(-15, zdict=PRESET_DICTIONARY)
+
+def encode_datagram(dgram_type, seq, payload=b""):
+    return DATAGRAM_HEADER.pack(FRAME_MAGIC, dgram_type, seq) + payload
+
+# Returns (datagram type, sequence number, payload)
+def decode_datagram(data):
+    if len(data) < DATAGRAM_HEADER.size:
+        raise ValueError("short datagram")
+    magic, dgram_type, seq = DATAGRAM_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ValueError("not a game datagram")
+    return dgram_type, seq, data[DATAGRAM_HEADER.size:]
+
+# Turns a received message back into the dict form the handlers use
+# names maps entity ids back to player names
+def decode(msg_type, payload, names=None):
+    if msg_type == MSG_JSON:
+        return json.loads(payload)
+    if msg_type == MSG_MOVE:
+        if len(payload) != PLAYER_STATE.size:
+            raise ValueError("bad move frame")
+        entity_id, x, y, sprite_counter = PLAYER_STATE.unpack(payload)
+        return {
+            "type": "move",
+            "player": names.get(entity_id),
+            "position": [x / POSITION_SCALE, y / POSITION_SCALE],
+            "sprite_counter": sprite_counter if sprite_counter >= 0 else None
+        }
+    if msg_type == MSG_POSITIONS:
+        if len(payload) < COUNT.size:
+            raise ValueError("bad positions frame")
+        (count,) = COUNT.unpack_from(payload)
+        if len(payload) != COUNT.size + count * PLAYER_STATE.size:
+            raise ValueError("bad positions frame")
+        players = {}
+        for entity_id, x, y, sprite_counter in PLAYER_STATE.iter_unpack(payload[COUNT.size:]):
+            name = names.get(entity_id)
+            if name is not None:
+                players[name] = unpack_position(x, y, sprite_counter)
+        return {"type": "sync_positions", "players": players}
+    raise ValueError(f"unknown frame type {msg_type}")
@@ -0,0 +1,102 @@
+# replay.py
+# Plays back a match from its event log (see eventlog.py), for debugging what
+# happened on a server. Runs without pygame or a server.
+#
+#   python replay.py match_logs/<match id>.jsonl                 # as fast as possible
+#   python replay.py match_logs/<match id>.jsonl --speed 10      # 10x real time
+#   python replay.py match_logs/<match id>.jsonl --start 120 --until 180
+#
+# Every snapshot met during playback is compared with the replayed state, so a
+# change the log is missing shows up as a mismatch.
+import argparse
+import time
+from eventlog import read_log, new_state, apply_event
+
+def describe(record):
+    kind = record[1]
+    if kind == "j":
+        return f"{record[2]} joined at ({record[3]}, {record[4]})"
+    if kind == "m":
+        return f"{record[2]} moved to ({record[3]}, {record[4]})"
+    if kind == "p":
+        return f"{record[4]} picked up {record[3]} (v{record[2]})"
+    if kind == "u":
+        return f"{record[3]} unlocked (v{record[2]})"
+    if kind == "d":
+        return f"{record[3]} used up (v{record[2]})"
+    if kind == "l":
+        return f"{record[3]} left (v{record[2]})"
+    if kind == "s":
+        return f"snapshot at v{record[2]['version']}"
+    return f"unknown record {kind}"
+
+# Compares the replayed state with a snapshot from the log, returns a list of differences
+def differences(state, snapshot):
+    found = []
+    if state["version"] != snapshot["version"]:
+        found.append(f"version {state['version']} != {snapshot['version']}")
+    for key in ("players", "objects"):
+        if state[key] != snapshot[key]:
+            extra = set(state[key]) - set(snapshot[key])
+            missing = set(snapshot[key]) - set(state[key])
+            changed = [k for k in set(state[key]) & set(snapshot[key]) if state[key][k] != snapshot[key][k]]
+            found.append(f"{key}: extra {sorted(extra)}, missing {sorted(missing)}, changed {sorted(changed)}")
+    return found
+
+def replay(path, speed=0, start=0, until=None, quiet=False):
+    records = list(read_log(path))
+    if not records or records[0][1] != "h":
+        raise ValueError(f"{path} is not an event log")
+    header = records[0][2]
+    print(f"[REPLAY] match {header['match']} room {header['room']} map {header['map']}, "
+          f"started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['started']))}")
+
+    # Start from the newest snapshot at or before the start time instead of the beginning
+    start_ms = start * 1000
+    first = 1
+    for i, record in enumerate(records):
+        if record[1] == "s" and record[0] <= start_ms:
+            first = i
+    state = new_state()
+    mismatches = 0
+    applied = 0
+    wall_start = time.perf_counter()
+    previous_ms = records[first][0]
+    for record in records[first:]:
+        ms = record[0]
+        if until is not None and ms > until * 1000:
+            break
+        if speed > 0 and ms > previous_ms:
+            time.sleep((ms - previous_ms) / 1000 / speed)
+        previous_ms = ms
+        if record[1] == "s" and applied:
+            problems = differences(state, record[2])
+            if problems:
+                mismatches += 1
+                print(f"[!] {ms / 1000:9.3f}s state differs from the logged snapshot: {'; '.join(problems)}")
+        apply_event(state, record)
+        applied += 1
+        if not quiet and ms >= start_ms:
+            print(f"{ms / 1000:9.3f}s  {describe(record)}")
+
+    elapsed = time.perf_counter() - wall_start
+    match_seconds = (previous_ms - records[first][0]) / 1000
+    keys = sum(1 for obj in state["objects"].values() if obj.get("type") == "key")
+    locked = sum(1 for obj in state["objects"].values() if obj.get("type") == "door" and obj.get("locked"))
+    print(f"[REPLAY] {applied} records, {match_seconds:.1f}s of match in {elapsed:.2f}s, "
+          f"{mismatches} snapshot mismatches")
+    print(f"[REPLAY] final v{state['version']}: players {sorted(state['players'])}, "
+          f"{keys} keys, {locked} locked doors")
+    return state, mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a match from its event log")
+    parser.add_argument("log", help="a .jsonl file from event_log_dir")
+    parser.add_argument("--speed", type=float, default=0, help="playback speed, 10 is 10x real time, 0 is no waiting")
+    parser.add_argument("--start", type=float, default=0, help="seconds into the match to start printing from")
+    parser.add_argument("--until", type=float, default=None, help="seconds into the match to stop at")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary and mismatches")
+    args = parser.parse_args()
+    _, mismatches = replay(args.log, args.speed, args.start, args.until, args.quiet)
+    if mismatches:
+        raise SystemExit(1)
@@ -0,0 +1,173 @@
+# rooms.py
+# Rooms let one server run many independent matches. Each room is its own
+# SyncManager. RoomManager holds the rooms of one process, Router runs in the
+# front-end process of a sharded server and decides which worker process owns
+# each room.
+import itertools
+import threading
+from config import max_players_per_room, session_grace
+from sync_manager import SyncManager
+
+class RoomManager:
+    def __init__(self, tick_rate=None, on_event=None):
+        self.rooms = {}          # room name -> SyncManager
+        self.client_rooms = {}   # client connection -> room name
+        self.room_clients = {}   # room name -> set of client connections
+        self.auto_rooms = []     # Rooms created by matchmaking, in creation order
+        self.tick_rate = tick_rate
+        self.map_file = None     # Map file path every room plays, None uses config.tile_map
+        self.udp = None          # UdpChannel handed to every room, set by the server when UDP is enabled
+        self.defer_sync = False  # Rooms broadcast on flush() only, set by StateThread
+        self.on_event = on_event  # Called as on_event("left" | "closed", room), lets a Router track load
+        self.room_numbers = itertools.count(1)
+        self.lock = threading.Lock()  # In thread mode joins and disconnects come from many threads
+
+    # Finds a matchmade room with a free slot, or names a new one
+    def matchmake(self):
+        for name in self.auto_rooms:
+            if len(self.room_clients.get(name, ())) < max_players_per_room:
+                return name
+        name = f"room-{next(self.room_numbers)}"
+        self.auto_rooms.append(name)
+        return name
+
+    def get_room(self, name):
+        sm = self.rooms.get(name)
+        if sm is None:
+            print(f"[ROOM] Opening room {name}")
+            sm = SyncManager(self.map_file)
+            sm.room = name
+            if self.tick_rate is not None:
+                sm.tick_rate = self.tick_rate
+            sm.udp = self.udp
+            sm.defer_sync = self.defer_sync
+            self.rooms[name] = sm
+        return sm
+
+    # Puts the client in the room named in its join, or matchmakes one
+    # Returns the room's SyncManager, or None if the room refused the join
+    def join(self, client, message_dict):
+        with self.lock:
+            name = message_dict.get("room") or self.matchmake()
+            sm = self.get_room(name)
+            self.client_rooms[client] = name
+            self.room_clients.setdefault(name, set()).add(client)
+        if sm.handle_join(client, message_dict):
+            return sm
+        # Refused, e.g. the name is taken: the connection takes no slot in the room
+        with self.lock:
+            self.client_rooms.pop(client, None)
+            self.room_clients.get(name, set()).discard(client)
+        if self.on_event:
+            self.on_event("left", name)  # A Router counted this player when it routed the join
+        return None
+
+    def room_of(self, client):
+        name = self.client_rooms.get(client)
+        if name is None:
+            return None
+        return self.rooms.get(name)
+
+    def disconnect(self, client):
+        with self.lock:
+            name = self.client_rooms.pop(client, None)
+            if name is None:
+                return
+            self.room_clients.get(name, set()).discard(client)
+            sm = self.rooms.get(name)
+        if sm is not None:
+            sm.handle_disconnect(client)
+        if self.on_event:
+            self.on_event("left", name)
+        if sm is not None and not sm.player_positions:
+            self.close_room(name, force=False)
+
+    # Tears a room down; without force the room is kept if anyone joined it meanwhile
+    def close_room(self, name, force=True):
+        with self.lock:
+            if not force and self.room_clients.get(name):
+                return
+            sm = self.rooms.pop(name, None)
+            self.room_clients.pop(name, None)
+            if name in self.auto_rooms:
+                self.auto_rooms.remove(name)
+        if sm is None:
+            return
+        # The last handle_disconnect already called reset_game_state; a forced close still has players
+        if sm.player_positions:
+            sm.reset_game_state()
+        print(f"[ROOM] Closed room {name}")
+        if self.on_event:
+            self.on_event("closed", name)
+
+    def tick(self):
+        for name, sm in list(self.rooms.items()):
+            sm.tick()
+            if not sm.player_positions and not self.room_clients.get(name):
+                self.close_room(name, force=False)  # Last held session expired
+
+    # Seconds between tick() calls, None if nothing needs ticking
+    def tick_interval(self):
+        if self.tick_rate > 0:
+            return 1 / self.tick_rate
+        if session_grace > 0:
+            return 1.0  # Held sessions still have to expire when position ticks are off
+        return None
+
+    def flush(self):
+        for sm in list(self.rooms.values()):
+            sm.flush()
+
+    def player_count(self):
+        return sum(len(sm.player_positions) for sm in list(self.rooms.values()))
+
+
+# Front-end bookkeeping for a sharded server: which worker owns which room,
+# and how many players have been routed to each so new rooms go to the least loaded worker
+class Router:
+    def __init__(self, pipes):
+        self.pipes = pipes                      # One multiprocessing pipe per worker
+        self.room_workers = {}                  # room name -> worker index
+        self.room_players = {}                  # room name -> players routed there and not yet gone
+        self.worker_players = [0] * len(pipes)  # worker index -> players routed there
+        self.auto_rooms = []
+        self.room_numbers = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def matchmake(self):
+        for name in self.auto_rooms:
+            if self.room_players.get(name, 0) < max_players_per_room:
+                return name
+        name = f"room-{next(self.room_numbers)}"
+        self.auto_rooms.append(name)
+        return name
+
+    # Picks the room and worker for a join, returns (room, worker index)
+    def route(self, message_dict):
+        with self.lock:
+            room = message_dict.get("room") or self.matchmake()
+            worker = self.room_workers.get(room)
+            if worker is None:
+                worker = min(range(len(self.pipes)), key=lambda i: self.worker_players[i])
+                self.room_workers[room] = worker
+            self.room_players[room] = self.room_players.get(room, 0) + 1
+            self.worker_players[worker] += 1
+            return room, worker
+
+    # Passes an accepted socket to a worker process
+    def hand_off(self, worker, client_socket, message_dict, leftover):
+        with self.lock:
+            self.pipes[worker].send((client_socket, message_dict, leftover))
+
+    # Called with the events workers report back through their pipes
+    def handle_event(self, event, room):
+        with self.lock:
+            if event == "left" and room in self.room_players:
+                self.room_players[room] -= 1
+                self.worker_players[self.room_workers[room]] -= 1
+            elif event == "closed" and self.room_players.get(room, 0) <= 0:
+                # Only forget the room if nobody was routed to it after the worker closed it
+                self.room_players.pop(room, None)
+                self.room_workers.pop(room, None)
+                if room in self.auto_rooms:
+                    self.auto_rooms.remove(room)
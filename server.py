@@ -1,56 +1,134 @@
 # server.py
+import argparse
+import asyncio
+import multiprocessing
+import signal
 import socket
+import sys
 import threading
-import json
-from sync_manager import SyncManager
+import time
+import protocol
+from config import tick_rate, recv_buffer_size, map_file
+from connection import ThreadedConnection, AsyncConnection
+from rooms import RoomManager, Router
+from udp import UdpChannel
+from metrics import metrics
+from actor import StateThread
+from framing import FrameReader
+from mapfile import open_map
 
 # Server will listen on all network interfaces (0.0.0.0) and this port
 HOST = "0.0.0.0"
 PORT = 5555
 
-sm = SyncManager()  # Single global game state
+# Pending connection queue size, large enough for a burst of players joining at once
+BACKLOG = 1024
+
+# The stats endpoint is only reachable from this machine
+STATS_HOST = "127.0.0.1"
+
+rooms = RoomManager(tick_rate)  # Every match running in this process, one SyncManager per room
+metrics.gauge("rooms", lambda: len(rooms.rooms))
+metrics.gauge("players", rooms.player_count)
+metrics.gauge("held_sessions", lambda: sum(len(sm.suspended) for sm in list(rooms.rooms.values())))
+
+# Thread mode applies every command on this one thread, client threads only parse and submit
+state = StateThread(rooms)
+
+# Message types clients may send, anything else is counted as "unknown" so metric names stay bounded
+MESSAGE_TYPES = {"join", "move", "pickup", "unlock", "delete_key", "ack", "resync", "get_static_map", "get_chunks"}
+
+# Counts and times every decoded message, see route_message for the handlers
+def dispatch(client, message_dict):
+    msg_type = message_dict.get("type")
+    label = msg_type if msg_type in MESSAGE_TYPES else "unknown"
+    metrics.count(f"recv.{label}")
+    started = time.perf_counter()
+    route_message(client, msg_type, message_dict)
+    metrics.observe(f"handler.{label}", time.perf_counter() - started)
+
+# Routes one decoded message to the matching SyncManager handler
+def route_message(client, msg_type, message_dict):
+    #print(f"[+] Received message: {message_dict}")
+    if msg_type == "join":
+        rooms.join(client, message_dict)
+        return
+    sm = rooms.room_of(client)
+    if sm is None:
+        print(f"[!] {msg_type} message before join")
+        return
+    if msg_type == "move":
+        sm.handle_move(client, message_dict)
+    elif msg_type == "pickup":
+        sm.handle_objects(client, message_dict)
+    elif msg_type == "unlock":
+        sm.handle_objects(client, message_dict)
+    elif msg_type == "delete_key":
+        sm.handle_objects(client, message_dict)
+    elif msg_type == "ack":
+        sm.handle_ack(client, message_dict)
+    elif msg_type == "resync":
+        sm.handle_resync(client, message_dict)
+    elif msg_type == "get_static_map":
+        sm.handle_get_static_map(client, message_dict)
+    elif msg_type == "get_chunks":
+        sm.handle_get_chunks(client, message_dict)
+    else:
+        print(f"[!] Unknown message type: {msg_type}")
+
+# Thread mode: hands a message to the state thread instead of handling it on the caller's thread
+def submit(client, message_dict):
+    state.submit(dispatch, client, message_dict)
+
+# Entity id -> player name table of the client's room, used to decode binary frames
+# Only read from client threads, so a lookup is safe while the state thread updates it
+def player_names(client):
+    sm = rooms.room_of(client)
+    return sm.player_names if sm is not None else {}
+
+# Position updates go over UDP on the same port number as TCP, unless started with --no-udp
+udp = UdpChannel(PORT, dispatch, player_names)
+
+# Exposes the metrics over HTTP and/or a dump file rewritten every interval seconds
+def start_stats(port, path, interval):
+    if port:
+        metrics.serve_http(STATS_HOST, port)
+    if path:
+        metrics.start_dump(path, interval)
 
 # Handles incoming messages from a specific client
 def handle_client(client_socket, addr):
     print(f"[+] New connection from {addr}")
-    buffer = "" # Used to store incomplete message data
+    conn = ThreadedConnection(client_socket, addr)  # Outgoing messages are written by its own thread
+    frames = FrameReader()  # Holds incomplete message data between reads
     try:
         while True:
-            data = client_socket.recv(1024).decode() # Receive message chunk
-            if not data:
+            count = frames.recv_from(client_socket)  # Receive straight into the frame buffer
+            if not count:
                 break  # No data means the client has disconnected
-            buffer += data  # Accumulate data in buffer
-            while "\n" in buffer:
-                # Split the buffer at newline to process complete JSON messages
-                msg_json, buffer = buffer.split("\n", 1)
+            conn.bytes_in += count
+            # Split off every complete JSON line or binary frame
+            for msg_type, payload in frames.messages():
                 try:
-                    message_dict = json.loads(msg_json) # Decode JSON string to dict
-                    msg_type = message_dict.get("type")
-                    #print(f"[+] Received message: {message_dict}")
-                    if msg_type == "join":
-                        sm.handle_join(client_socket, message_dict)
-                    elif msg_type == "move":
-                        sm.handle_move(client_socket, message_dict)
-                    elif msg_type == "pickup":
-                        sm.handle_objects(client_socket, message_dict)
-                    elif msg_type == "unlock":
-                        sm.handle_objects(client_socket, message_dict)
-                    elif msg_type == "delete_key":
-                        sm.handle_objects(client_socket, message_dict)
-                    else:
-                        print(f"[!] Unknown message type: {msg_type}")
-                except json.JSONDecodeError as e:
-                    print(f"[!] JSON decode error: {e}")
+                    message_dict = protocol.decode(msg_type, payload, player_names(conn))
+                    submit(conn, message_dict)
+                except ValueError as e:  # Bad JSON or a malformed frame
+                    print(f"[!] Decode error: {e}")
     except Exception as e:
         print(f"[!] Client error: {e}")
     finally:
         # Cleanup after client disconnects
         print(f"[-] Disconnected: {addr}")
-        sm.handle_disconnect(client_socket)
+        state.submit(rooms.disconnect, conn)
+        conn.close()
         client_socket.close()
 
 # Starts the server and listens for new connections
 def start_server():
+    state.start()  # Also runs the server tick
+    if rooms.udp is not None:
+        udp.dispatch = submit
+        udp.start_thread(HOST)
     # Create a TCP socket using IPv4
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.bind((HOST, PORT))  # Bind the socket to host and port
@@ -63,6 +141,229 @@ def start_server():
         # Handle each client in its own thread
         threading.Thread(target=handle_client, args=(client_socket, addr), daemon=True).start()
 
+
+# Event loop version of handle_client, one coroutine per connection
+# A sharded worker passes in the join the router already read, and any bytes after it
+async def handle_client_async(reader, writer, join_message=None, buffer=b""):
+    client = AsyncConnection(writer)
+    print(f"[+] New connection from {client.addr}")
+    frames = FrameReader()
+    frames.feed(buffer)
+    try:
+        if join_message is not None:
+            dispatch(client, join_message)
+        while True:
+            for msg_type, payload in frames.messages():
+                try:
+                    message_dict = protocol.decode(msg_type, payload, player_names(client))
+                    dispatch(client, message_dict)
+                except ValueError as e:  # Bad JSON or a malformed frame
+                    print(f"[!] Decode error: {e}")
+            data = await reader.read(recv_buffer_size)
+            if not data:
+                break  # EOF means the client has disconnected
+            client.bytes_in += len(data)
+            frames.feed(data)
+    except Exception as e:
+        print(f"[!] Client error: {e}")
+    finally:
+        print(f"[-] Disconnected: {client.addr}")
+        rooms.disconnect(client)
+        client.close()
+
+# Raise the open file limit so one process can hold thousands of idle sockets
+def raise_fd_limit():
+    try:
+        import resource
+    except ImportError:
+        return  # Not available on Windows
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        target = hard if hard != resource.RLIM_INFINITY else max(soft, 65536)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        except (ValueError, OSError):
+            pass
+
+# Drives RoomManager.tick at a fixed rate, as a task on the event loop
+async def tick_loop_async():
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        next_tick += rooms.tick_interval()
+        started = time.perf_counter()
+        try:
+            rooms.tick()
+        except Exception as e:
+            print(f"[!] Tick error: {e}")
+        metrics.observe("tick", time.perf_counter() - started)
+        delay = next_tick - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            next_tick = loop.time()
+            await asyncio.sleep(0)
+
+# Runs every connection and all SyncManager handlers on a single event loop
+async def serve_async():
+    tick_task = None
+    if rooms.tick_interval():
+        tick_task = asyncio.create_task(tick_loop_async())  # Keep a reference so it isn't collected
+    if rooms.udp is not None:
+        await udp.start_async(HOST)
+    server = await asyncio.start_server(handle_client_async, HOST, PORT, backlog=BACKLOG)
+    print(f"[SERVER] Listening on {HOST}:{PORT} (asyncio)")
+    async with server:
+        await server.serve_forever()
+
+def start_async_server():
+    raise_fd_limit()
+    try:
+        asyncio.run(serve_async())
+    except KeyboardInterrupt:
+        pass
+
+
+# Sharded mode: a front-end process accepts connections, reads each join and
+# hands the socket to the worker process that owns the requested room.
+# Every worker runs its rooms on its own asyncio event loop, one per core.
+
+# Entry point of a worker process
+# Each worker has its own UDP port, PORT + 1 + index, since datagrams can't be handed off like sockets
+# Stats work the same way: stats_port + 1 + index, and one dump file per worker
+def run_worker(index, pipe, worker_tick_rate, worker_map_file, use_udp, stats):
+    rooms.tick_rate = worker_tick_rate
+    rooms.map_file = worker_map_file
+    stats_port, stats_file, stats_interval = stats
+    start_stats(stats_port + 1 + index if stats_port else None,
+                f"{stats_file}.worker{index}" if stats_file else None, stats_interval)
+    if use_udp:
+        udp.port = PORT + 1 + index
+        rooms.udp = udp
+    rooms.on_event = lambda event, room: pipe.send((event, room))  # Lets the router track room load
+    raise_fd_limit()
+    try:
+        asyncio.run(serve_worker(index, pipe))
+    except KeyboardInterrupt:
+        pass
+
+async def serve_worker(index, pipe):
+    loop = asyncio.get_running_loop()
+    tick_task = None
+    if rooms.tick_interval():
+        tick_task = asyncio.create_task(tick_loop_async())
+    if rooms.udp is not None:
+        await udp.start_async(HOST)
+    done = loop.create_future()
+
+    # Blocking pipe reads happen on a helper thread, each socket is then adopted by the event loop
+    def receive_handoffs():
+        while True:
+            try:
+                client_socket, join_message, leftover = pipe.recv()
+            except (EOFError, OSError):
+                loop.call_soon_threadsafe(done.set_result, None)  # Router went away
+                return
+            asyncio.run_coroutine_threadsafe(adopt_client(client_socket, join_message, leftover), loop)
+
+    threading.Thread(target=receive_handoffs, daemon=True).start()
+    print(f"[WORKER {index}] Ready")
+    await done
+
+async def adopt_client(client_socket, join_message, leftover):
+    reader, writer = await asyncio.open_connection(sock=client_socket)
+    await handle_client_async(reader, writer, join_message, leftover)
+
+# Reads a new connection's join on the front end, then routes it to a worker
+def route_client(router, client_socket, addr):
+    try:
+        client_socket.settimeout(10)  # Don't hold a routing thread forever for a silent client
+        frames = FrameReader()
+        messages = []
+        while not messages:
+            if not frames.recv_from(client_socket):
+                client_socket.close()
+                return
+            messages = frames.messages(max_messages=1)
+        message_dict = protocol.decode(*messages[0])  # The join is always plain JSON
+        if message_dict.get("type") != "join":
+            print(f"[!] {addr} did not start with a join")
+            client_socket.close()
+            return
+        room, worker = router.route(message_dict)
+        message_dict["room"] = room
+        client_socket.settimeout(None)
+        router.hand_off(worker, client_socket, message_dict, frames.leftover())
+        print(f"[ROUTER] {addr} -> room {room} on worker {worker}")
+    except (OSError, ValueError) as e:
+        print(f"[!] Routing error for {addr}: {e}")
+    # The worker received its own duplicate of the socket
+    client_socket.close()
+
+# Forwards "left" and "closed" events from one worker to the router
+def watch_worker(router, pipe):
+    while True:
+        try:
+            event, room = pipe.recv()
+        except (EOFError, OSError):
+            return
+        router.handle_event(event, room)
+
+def start_sharded_server(worker_count, use_udp, stats=(None, None, 10)):
+    # Exit normally on SIGTERM so multiprocessing stops the workers instead of orphaning them
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    pipes = []
+    for index in range(worker_count):
+        parent_pipe, child_pipe = multiprocessing.Pipe()
+        multiprocessing.Process(target=run_worker, args=(index, child_pipe, rooms.tick_rate, rooms.map_file, use_udp, stats), daemon=True).start()
+        pipes.append(parent_pipe)
+    router = Router(pipes)
+    for pipe in pipes:
+        threading.Thread(target=watch_worker, args=(router, pipe), daemon=True).start()
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Restart without waiting out TIME_WAIT
+    server.bind((HOST, PORT))
+    server.listen(BACKLOG)
+    print(f"[SERVER] Listening on {HOST}:{PORT} ({worker_count} worker processes)")
+    try:
+        while True:
+            client_socket, addr = server.accept()
+            threading.Thread(target=route_client, args=(router, client_socket, addr), daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+
 # Entry point of the server script
 if __name__ == "__main__":
-    start_server()
+    parser = argparse.ArgumentParser(description="CMPT371 game server")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="thread: one thread per client, async: single asyncio event loop")
+    parser.add_argument("--tick-rate", type=float, default=rooms.tick_rate,
+                        help="position broadcasts per second, 0 to send on every move")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes; more than 1 shards rooms across processes (each runs asyncio)")
+    parser.add_argument("--no-udp", action="store_true",
+                        help="send position updates over TCP only")
+    parser.add_argument("--stats-port", type=int, default=None,
+                        help="serve metrics as JSON on http://127.0.0.1:PORT/")
+    parser.add_argument("--stats-file", default=None,
+                        help="write metrics as JSON to this file every --stats-interval seconds")
+    parser.add_argument("--stats-interval", type=float, default=10)
+    parser.add_argument("--map-file", default=map_file,
+                        help="play a map file made with mapfile.py instead of config.tile_map")
+    args = parser.parse_args()
+    rooms.tick_rate = args.tick_rate
+    rooms.map_file = args.map_file
+    if args.map_file:
+        game_map = open_map(args.map_file)  # Fails here on a bad file instead of at the first join
+        print(f"[SERVER] Map {args.map_file}: {game_map.width}x{game_map.height} tiles in chunks of {game_map.chunk_size}")
+    if not args.no_udp:
+        rooms.udp = udp
+    if args.workers > 1:
+        start_sharded_server(args.workers, not args.no_udp, (args.stats_port, args.stats_file, args.stats_interval))
+    else:
+        start_stats(args.stats_port, args.stats_file, args.stats_interval)
+        if args.mode == "async":
+            start_async_server()
+        else:
+            start_server()
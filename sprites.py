@@ -6,40 +6,61 @@ import math
 from mechanics import handle_tile_movement
 import traceback
 import client
-
-def tint_image(image, tint_color):
-    """Tints a surface by blending it with a given RGB color."""
-    tinted_image = image.copy()
-    tint = pygame.Surface(image.get_size(), pygame.SRCALPHA)
-    tint.fill(tint_color)  # This is already an RGB tuple
-    tinted_image.blit(tint, (0, 0), special_flags=pygame.BLEND_RGBA_MULT)
-    return tinted_image
-
+import assets
 
 # Handles character sprite sheet and allows extracting individual sprites
+# Sheets and pieces come from assets, so every tile using the same piece shares one surface
 class CharSprite:
     def __init__(self, file):
-        self.sheet = pygame.image.load(file).convert_alpha()  # Load sprite sheet
-        self.sheet = pygame.transform.scale(self.sheet, (tile_size * 6, tile_size * 4))  # Resize sheet for easier slicing
+        self.sheet = assets.image(file, tile_size * 6, tile_size * 4)  # Resized for easier slicing
         
     def get_sprite(self, x, y, width, height):
-        sprite = pygame.Surface([width, height], pygame.SRCALPHA)  # Create transparent surface
-        sprite.blit(self.sheet, (0, 0), (x, y, width, height))  # Extract sprite from sheet
-        return sprite
+        return assets.sheet_piece(self.sheet, x, y, width, height)
 
 
 # Handles single-tile sprites (walls, doors, keys, etc.)
 class Sprite:
     def __init__(self, file):
-        original = pygame.image.load(file).convert_alpha()  # Load image
-        self.image = pygame.transform.scale(original, (tile_size, tile_size))  # Resize to tile size
+        self.image = assets.image(file, tile_size, tile_size)  # Resized to tile size
         
     def get_sprite(self, *_):  # Crop parameters are ignored for single-tile sprites
         return self.image
 
 
+# Draws a player or key where the camera shows it, through game.dirty_sprites
+# The sprite itself keeps its world rect for movement and collisions
+class SpriteView(pygame.sprite.DirtySprite):
+    def __init__(self, sprite):
+        self.sprite = sprite
+        self._layer = sprite._layer
+        pygame.sprite.DirtySprite.__init__(self, sprite.game.dirty_sprites)
+        self.image = sprite.image
+        self.rect = sprite.rect.copy()
+
+    # Game.draw calls this every frame, so moves made from anywhere get drawn
+    def follow(self, camera):
+        rect = camera.apply(self.sprite.rect)
+        if rect != self.rect or self.image is not self.sprite.image:
+            self.rect = rect
+            self.image = self.sprite.image
+            self.dirty = 1
+        visible = 1 if camera.sees(self.sprite.rect) else 0  # Off screen sprites are skipped
+        if visible != self.visible:
+            self.visible = visible
+
+
+# Players and keys, drawn through a SpriteView instead of the background
+class MovingSprite(pygame.sprite.Sprite):
+    def show(self):
+        self.view = SpriteView(self)
+
+    def kill(self):
+        self.view.kill()
+        pygame.sprite.Sprite.kill(self)
+
+
 # Represents a player character in the game
-class Player(pygame.sprite.Sprite):
+class Player(MovingSprite):
     def __init__(self, game, x, y, player_name, main, sprite_idx=0):
         self.player_name = player_name
         self.main = main
@@ -56,20 +77,13 @@ class Player(pygame.sprite.Sprite):
         self.width = tile_size
         self.height = tile_size
 
-        # Determine sprite sheet coordinates based on index
-        sprites_per_row = 6
-        sx = (sprite_idx % sprites_per_row) * tile_size
-        sy = (sprite_idx // sprites_per_row) * tile_size
-
-        # Load and extract sprite from sheet
-        self.spritesheet = CharSprite("img/character_sprites.png")
-        raw_sprite = self.spritesheet.get_sprite(sx, sy, 32, 32)  # Original sprite size
-
-        self.image = pygame.transform.scale(raw_sprite, (self.width, self.height))  # Scale to tile size
+        # Cut from the character sheet once, when the first player appeared
+        self.image = assets.character(sprite_idx)
 
         self.rect = self.image.get_rect()
         self.rect.x = self.x
         self.rect.y = self.y
+        self.show()
 
         # Also reset target position
         self.target_pos = (self.rect.x, self.rect.y)
@@ -110,7 +124,7 @@ class Wall(pygame.sprite.Sprite):
         self.objectid = objectid
         self.game = game
         self._layer = wall_layer
-        self.groups = self.game.all_sprites, self.game.blocks
+        self.groups = self.game.blocks
         pygame.sprite.Sprite.__init__(self, self.groups)
 
         self.x = x * tile_size
@@ -122,6 +136,7 @@ class Wall(pygame.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.rect.x = self.x
         self.rect.y = self.y
+        self.game.add_tile(self)
 
 
 # Represents a door tile
@@ -132,7 +147,7 @@ class Door(pygame.sprite.Sprite):
         self.objectid = objectid
         self.game = game
         self._layer = wall_layer
-        self.groups = self.game.all_sprites, self.game.blocks
+        self.groups = self.game.blocks
         pygame.sprite.Sprite.__init__(self, self.groups)
 
         self.x = x * tile_size
@@ -141,12 +156,14 @@ class Door(pygame.sprite.Sprite):
         self.height = tile_size
 
         base_image = self.game.door_img.get_sprite(0, 0, self.width, self.height)
-        self.image = tint_image(base_image, colors.get(color, (255,0,0)))
+        self.image = assets.tinted(base_image, colors.get(color, (255,0,0)))
         self.rect = self.image.get_rect()
         self.rect.x = self.x
         self.rect.y = self.y
+        self.game.add_tile(self)
 
         self.locked = True
+        self.game.locked_doors.setdefault(color, {})[objectid] = self
 
     def try_unlock(self, player, dx, dy):
         if not self.locked:
@@ -164,8 +181,8 @@ class Door(pygame.sprite.Sprite):
 
         if self.rect.colliderect(next_rect):
             # Does the player have a key?
-            for sprite in self.game.all_sprites:
-                if isinstance(sprite, Key) and sprite.carried_by == player:
+            for sprite in self.game.keys_by_carrier.get(player.player_name, []):
+                if sprite.carried_by == player:
                     if sprite.color == self.color:
                         # print(f"[DEBUG] Door unlocked via try_unlock with matching key: {sprite.color}")
                         self.unlock()
@@ -178,24 +195,25 @@ class Door(pygame.sprite.Sprite):
 
         #print("[DEBUG] Door unlocking — replacing with floor and removing key.")
         self.locked = False
-        
+        self.game.locked_doors[self.color].pop(self.objectid, None)
 
         # Remove the key being carried by the player who unlocked the door
-        for sprite in list(self.game.all_sprites):
-            if isinstance(sprite, Key) and sprite.carried_by:
+        for sprite in [key for keys in self.game.keys_by_carrier.values() for key in keys]:
+            if sprite.carried_by:
                 player = sprite.carried_by
                 #print(f"[DEBUG] Key used by {player} — removing key.")
-                sprite.carried_by = None
+                self.game.drop_key(sprite)
                 sprite.used = True  # optional
                 sprite.kill()
                 client.send_action("delete_key", player.player_name, player.player_name, sprite.objectid, position=(sprite.rect.x, sprite.rect.y))
                 break
 
-        #print(f"[DEBUG] Keys in game: {[k for k in self.game.all_sprites if isinstance(k, Key)]}")
+        #print(f"[DEBUG] Keys in game: {list(self.game.keys)}")
         
         # Replace door with a floor tile
         Floor(self.game, self.rect.x // tile_size, self.rect.y // tile_size, "floorx")
         self.kill()
+        self.game.remove_tile(self)
 
         self.game.check_win_condition()
         #print("[DEBUG] Player added. Call stack:")
@@ -208,8 +226,7 @@ class Floor(pygame.sprite.Sprite):
         self.objectid = objectid
         self.game = game
         self._layer = floor_layer
-        self.groups = self.game.all_sprites
-        pygame.sprite.Sprite.__init__(self, self.groups)
+        pygame.sprite.Sprite.__init__(self)  # Only held by game.tiles, floors never update
 
         self.x = x * tile_size
         self.y = y * tile_size
@@ -220,10 +237,11 @@ class Floor(pygame.sprite.Sprite):
         self.rect = self.image.get_rect()
         self.rect.x = self.x
         self.rect.y = self.y
+        self.game.add_tile(self)
 
 
 # Represents a collectible key item
-class Key(pygame.sprite.Sprite):
+class Key(MovingSprite):
     def __init__(self, game, x, y, objectid, color="yellow"):
         self.color = color
         self.objectid = objectid
@@ -238,10 +256,11 @@ class Key(pygame.sprite.Sprite):
         self.height = tile_size
 
         base_image = game.key_img.get_sprite(32, 0, 32, 32)  # example key sprite
-        self.image = tint_image(base_image, colors.get(color, (255, 0, 0))) 
+        self.image = assets.tinted(base_image, colors.get(color, (255, 0, 0)))
         self.rect = self.image.get_rect()
         self.rect.x = self.x
         self.rect.y = self.y
+        self.show()
 
         self.carried_by = None  # Player carrying the key
         self.used = False
@@ -258,21 +277,21 @@ class Key(pygame.sprite.Sprite):
             self.rect.centery += (py - ky) * 0.1
         else:
             # Idle behavior or pickup logic
-            for player in self.game.players.values():
+            for player in self.game.players_touching(self.rect):
                 if self.rect.colliderect(player.rect):
-                    self.carried_by = player
+                    self.game.carry_key(self, player)
                     client.send_action("pickup", player.player_name, player.player_name, self.objectid, position=(self.rect.x, self.rect.y))
                     break
 
             #Only place a floor tile once, and only if not already used
 
 #Tutorial mesage logic handler
-class TutorialMessage(pygame.sprite.Sprite):
+class TutorialMessage(pygame.sprite.DirtySprite):
     def __init__(self, game, text, duration=3000):  # duration in ms
         self.game = game
         self._layer = 999  # Always on top
-        self.groups = self.game.all_sprites
-        pygame.sprite.Sprite.__init__(self, self.groups)
+        self.groups = self.game.all_sprites, self.game.dirty_sprites
+        pygame.sprite.DirtySprite.__init__(self, self.groups)
 
         self.font = pygame.font.SysFont("verdana", 24)
         self.text = text
@@ -285,6 +304,9 @@ class TutorialMessage(pygame.sprite.Sprite):
         self.duration = duration
         self.alpha = 255
 
+    def follow(self, camera):
+        pass  # Placed in window coordinates, stays put when the camera moves
+
     def update(self):
         # How long has it been visible
         elapsed = pygame.time.get_ticks() - self.start_time
@@ -294,5 +316,8 @@ class TutorialMessage(pygame.sprite.Sprite):
         else:
             # Fade out over time
             fade_speed = 255 / (self.duration / 100)  # adjust for smooth fade
-            self.alpha = max(0, 255 - int(elapsed * fade_speed / 10))
-            self.image.set_alpha(self.alpha)
+            alpha = max(0, 255 - int(elapsed * fade_speed / 10))
+            if alpha != self.alpha:
+                self.alpha = alpha
+                self.image.set_alpha(self.alpha)
+                self.dirty = 1  # Same place, new look
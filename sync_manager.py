@@ -1,144 +1,469 @@
 import json
-import pygame
-from sprites import *
+import math
+import os
+import secrets
+import time
+from collections import deque
 from config import *
+from geometry import rect, rects_overlap
+from tilemap import map_hash, encode_rows
+from objectstore import ObjectStore, KINDS, store_walls_and_floors, store_special_tiles, store_object_tiles
+from grid import OccupancyGrid, MappedGrid, LOCKED_DOOR, KEY
+from mapfile import open_map
+from interest import SpatialHash
+from eventlog import EventLog, prune_logs
+from metrics import metrics
+import protocol
+
+# Chunks answered per get_chunks, a client only ever needs the few around it
+MAX_CHUNKS_PER_REQUEST = 64
+
+# Kind of object each object message may change, a message naming any other object is ignored
+OBJECT_MESSAGE_KINDS = {"key": "key", "pickup": "key", "unlock": "door", "delete_key": "key"}
 
 class SyncManager:
-    def __init__(self):
-        self.clients = []                    # List of client sockets
+    def __init__(self, map_path=None):
+        self.clients = []                    # List of client connections (see connection.py)
         self.player_positions = {}  # player_name -> {x, y}
-        self.objects = {}  # object_id -> {type, x, y, possessed_by}
+        self.objects = ObjectStore()         # Doors and keys, see objectstore.py
+        self.static_objects = None           # ObjectStore of walls and floors, built when a legacy client needs them
+        self.map_rows = []                   # tile_map the static layer was built from
+        self.map_hash = None                 # Content hash of map_rows
+        self.map_encoded = []
+        self.map_path = map_path             # Map file to play instead of config.tile_map
+        self.map_file = None                 # MapFile once map_path is opened, walls and floors then go out in chunks
+        self.grid = None                     # OccupancyGrid of walls, locked doors and keys
+        self.legacy_clients = set()          # Clients that expect walls and floors inside sync_objects
         self.spawn_points = []
         self.next_object_id = 1                   # object_id -> object data
         self.door_unlocked = []
         self.passed_door = {}                # player_name -> bool
         self.socket_map = {}                 # player_name -> client_socket
-        self.key_number = 0
-        self.door_number = 0
-        self.floor_number = 0
-        self.wall_number = 0
+        self.version = 0                     # Bumped on every object change
+        # (version, op, object_id). Delta syncs after a resume or rejoin come only from here,
+        # never from the event log, so they reach back delta_history changes whether logging is on or not
+        self.object_changes = deque(maxlen=delta_history)
+        self.history_floor = 0               # Oldest version a delta can start from
+        self.client_versions = {}            # client_socket -> last acknowledged version
+        self.tick_rate = tick_rate           # Position broadcasts per second, 0 sends on every move
+        self.positions_dirty = False         # A move arrived since the last position broadcast
+        self.objects_dirty = False           # An object changed since the last sync_objects
+        self.defer_sync = False              # Set when a StateThread batches commands and calls flush()
+        self.client_protocols = {}           # client_socket -> "binary", clients missing here use JSON
+        self.player_ids = {}                 # player_name -> integer entity id used by the binary protocol
+        self.player_names = {}               # entity id -> player_name
+        self.next_player_id = 1
+        self.udp = None                      # UdpChannel shared by the rooms of this process, if enabled
+        self.interest_radius = interest_radius  # Tiles, 0 sends every player's position to everyone
+        self.interest = SpatialHash(interest_radius)  # Players bucketed by tile, for area-of-interest queries
+        self.visible = {}                    # client_socket -> player names it was last sent
+        self.room = None                     # Room name, set by RoomManager
+        self.match_id = None                 # New for every map initialization, lets clients resume the same match
+        self.log = None                      # EventLog of the current match, opened at its first join
+        self.log_full = False                # The match's log reached event_log_max_bytes, not reopened until the next match
+        self.session_grace = session_grace   # Seconds a dropped player is held for a resume
+        self.sessions = {}                   # session token -> player_name
+        self.player_sessions = {}            # player_name -> session token
+        self.suspended = {}                  # player_name -> (deadline, last acked version) while disconnected
         self.initialize_map()
         
         
-    def broadcast(self, message_dict, sender_socket=None):
-        message_json = json.dumps(message_dict).encode()
+    # unreliable=True lets clients paired over UDP get the message as a datagram
+    def broadcast(self, message_dict, sender_socket=None, unreliable=False):
+        started = time.perf_counter()
+        encoded = {}  # protocol -> bytes, each format is only encoded once
         for client in list(self.clients):
-            try:
-                client.sendall(message_json + b"\n")
-            except:
-                self.clients.remove(client)
+            proto = self.client_protocols.get(client, "json")
+            if proto not in encoded:
+                encoded[proto] = protocol.encode(message_dict, proto, self.player_ids)
+            self.deliver(client, proto, encoded[proto], message_dict.get("type"), unreliable)
+        metrics.observe(f"broadcast.{message_dict.get('type')}", time.perf_counter() - started)
+
+    # Sends already encoded data, as a datagram if allowed and the client is paired over UDP
+    def deliver(self, client, proto, data, kind, unreliable=False):
+        if (unreliable and proto == "binary" and self.udp is not None and self.udp.is_paired(client)
+                and len(data) <= protocol.MAX_DATAGRAM):
+            self.udp.send_positions(client, data[protocol.HEADER.size:])
+            return
+        client.send(data, kind)
+
+    def send(self, client, message_dict):
+        proto = self.client_protocols.get(client, "json")
+        client.send(protocol.encode(message_dict, proto, self.player_ids), message_dict.get("type"))
+
+    # Tells binary clients which entity id belongs to which player
+    def send_player_ids(self):
+        for client, proto in list(self.client_protocols.items()):
+            if proto == "binary":
+                self.send(client, {"type": "player_ids", "players": self.player_ids})
+
+    # Records a change to one object so it can be sent as part of a delta
+    # op is "add", "change" or "remove"
+    def mark_changed(self, object_id, op="change"):
+        if len(self.object_changes) == self.object_changes.maxlen:
+            # The oldest entry is about to be dropped, deltas can no longer start before it
+            self.history_floor = self.object_changes[0][0]
+        self.version += 1
+        self.object_changes.append((self.version, op, object_id))
+
+    # Collapses all changes after base_version into added/changed/removed sets
+    def changes_since(self, base_version):
+        first_op = {}
+        for version, op, object_id in reversed(self.object_changes):
+            if version <= base_version:
+                break
+            first_op[object_id] = op  # Walking backwards, the last write is the earliest op
+        added, changed, removed = {}, {}, []
+        for object_id, op in first_op.items():
+            obj = self.objects.get(object_id)
+            if obj is None:
+                removed.append(object_id)
+            elif op == "add":
+                added[object_id] = obj
+            else:
+                changed[object_id] = obj
+        return added, changed, removed
 
     def initialize_map(self):
         from config import tile_map  # Import tile_map here
-        from config import colors 
-        color_map = {
-            "K": "red",     # Red Key
-            "G": "green",   # Green Key
-            "Y": "orange",  # Orange Key
-            "X": "maroon",  # Maroon Key
-            "D": "red",     # Red Door
-            "E": "green",   # Green Door
-            "F": "orange",  # Orange Door
-            "Z": "maroon"   # Maroon Door
-        }
-        for i, row in enumerate(tile_map):
-            for j, tile in enumerate(row):
-                x, y = j , i 
-                if tile == "B":
-                    self.objects[f"wall{self.wall_number}"] = {"id":f"wall{self.wall_number}","type": "wall", "x": x, "y": y}
-                    self.wall_number += 1
-                elif tile in ["D", "E", "F", "Z"]:
-                    color = color_map[tile]
-                    self.objects[f"floor{self.floor_number}"] = {"id":f"floor{self.floor_number}","type": "floor", "x": x, "y": y}
-                    self.objects[f"door{self.door_number}"] = {"id":f"door{self.door_number}","type": "door", "x": x, "y": y,"color": color ,"locked": True}
-                    self.door_number += 1
-                elif tile in ["K", "Y", "G", "X"]:
-                    color = color_map[tile]
-                    self.objects[f"floor{self.floor_number}"] = {"id":f"floor{self.floor_number}","type": "floor", "x": x, "y": y}
-                    self.objects[f"key{self.key_number}"] = {"id":f"key{self.key_number}","type": "key", "x": x, "y": y,"color": color ,"possessed_by": None}
-                    self.key_number += 1
-                    self.floor_number += 1
-                elif tile == ".":
-                    self.objects[f"floor{self.floor_number}"] = {"id":f"floor{self.floor_number}","type": "floor", "x": x, "y": y}
-                    self.floor_number += 1
-                elif tile == "P":
-                    self.objects[f"floor{self.floor_number}"] = {"id":f"floor{self.floor_number}","type": "floor", "x": x, "y": y}
-                    self.floor_number += 1
-                    self.spawn_points.append((x, y))
+        self.close_log()
+        self.log_full = False
+        self.match_id = secrets.token_hex(8)
+        if self.map_path:
+            # Large map: only doors, keys and spawn points are loaded, tiles are read from the mapping when needed
+            self.map_file = open_map(self.map_path)
+            self.static_objects = ObjectStore()  # Legacy clients can't be sent a map this big
+            self.objects, self.spawn_points = store_object_tiles(self.map_file.objects)
+            self.grid = MappedGrid.from_map_file(self.map_file)
+            self.map_hash = self.map_file.hash
+        else:
+            # Walls and floors are kept apart from doors and keys, they are sent once per client by hash
+            self.objects, self.spawn_points = store_special_tiles(tile_map)
+            self.grid = OccupancyGrid.from_tile_map(tile_map)
+            new_hash = map_hash(tile_map)
+            if new_hash != self.map_hash:
+                self.map_rows = list(tile_map)
+                self.map_hash = new_hash
+                self.map_encoded = encode_rows(tile_map)  # Run-length encoded rows, sent at join
+                self.static_objects = None
+        # Every object was replaced, so no old delta applies anymore and clients need a full snapshot
+        self.version += 1
+        self.object_changes.clear()
+        self.history_floor = self.version
+        self.client_versions.clear()
         self.sync_objects()
 
+    # Starts the match's event log with a header and a snapshot of the fresh map
+    def open_log(self):
+        if not event_log_dir or self.log_full:
+            return
+        # Relative to the game folder, so logs do not end up wherever the server was started from
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), event_log_dir)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            prune_logs(directory, event_log_keep)
+            self.log = EventLog(os.path.join(directory, f"{self.match_id}.jsonl"), {
+                "match": self.match_id,
+                "room": self.room,
+                "map": self.map_hash,
+                "started": time.time()
+            }, snapshot_every)
+            self.log.snapshot(self.version, self.player_positions, self.objects.wire())
+        except OSError as e:
+            print(f"[!] Could not open event log: {e}")
+            self.log = None
+
+    # Appends one accepted change to the event log, see eventlog.py for the record layout
+    def record(self, kind, *fields):
+        if self.log is None:
+            return
+        try:
+            self.log.append(kind, *fields)
+            if self.log.snapshot_due():
+                self.log.snapshot(self.version, self.player_positions, self.objects.wire())
+            if self.log.size >= event_log_max_bytes:
+                print(f"[!] Event log {self.log.path} reached {event_log_max_bytes} bytes, logging stopped for this match")
+                self.close_log()
+                self.log_full = True
+        except OSError as e:
+            print(f"[!] Event log write failed, logging stopped: {e}")
+            self.close_log()
+
+    def close_log(self):
+        if self.log is not None:
+            try:
+                self.log.close()
+            except OSError:
+                pass
+            self.log = None
+
+    # Returns False if the join was refused, the client is then told so and is not part of the room
     def handle_join(self, client_socket, message_dict):
         player_name = message_dict.get("player")
-        if player_name in self.player_positions:
+        token = message_dict.get("session")
+        resumed = self.resume_session(player_name, token)
+        if player_name in self.player_positions and resumed is None:
+            # Only the token gets a player back, a held player's name stays taken until their grace period ends
             print(f"Player {player_name} already joined.")
-            return
+            self.send(client_socket, {"type": "join_rejected", "player": player_name, "reason": "name_taken"})
+            return False
 
-        # Lazily initialize map on first player join
-        if not self.player_positions:
-            print("First player joined — initializing map.")
-            self.initialize_map()
+        if resumed is None:
+            # Lazily initialize map on first player join
+            if not self.player_positions:
+                print("First player joined — initializing map.")
+                self.initialize_map()
+            if self.log is None:
+                self.open_log()
 
-        # Assign spawn position
-        if self.spawn_points:
-            x, y = self.spawn_points[len(self.player_positions) % len(self.spawn_points)]
-        else:
-            x, y = 100, 100  # Fallback
+            # Assign spawn position
+            if self.spawn_points:
+                x, y = self.spawn_points[len(self.player_positions) % len(self.spawn_points)]
+            else:
+                x, y = 100, 100  # Fallback
 
-        # Register player
+            # Register player
+            self.player_ids[player_name] = self.next_player_id
+            self.player_names[self.next_player_id] = player_name
+            self.next_player_id += 1
+            if "protocols" in message_dict:
+                # Only clients that read the welcome can learn their token and resume
+                token = secrets.token_hex(16)
+                self.sessions[token] = player_name
+                self.player_sessions[player_name] = token
         self.clients.append(client_socket)
-        
-        self.player_positions[player_name] = {"x": x, "y": y}
-        self.passed_door[player_name] = False
-        self.socket_map[player_name] = client_socket
+        if "protocols" in message_dict:
+            # Client can speak more than JSON, pick the most compact format we both know
+            if "binary" in message_dict["protocols"]:
+                self.client_protocols[client_socket] = "binary"
+            welcome = {
+                "type": "welcome",
+                "protocol": self.client_protocols.get(client_socket, "json"),
+                "player_id": self.player_ids[player_name],
+                "room": self.room,
+                "match": self.match_id,
+                "session": self.player_sessions[player_name]
+            }
+            if message_dict.get("udp") and self.udp is not None and welcome["protocol"] == "binary":
+                # Position updates can go over UDP once the client sends this token back in a datagram
+                welcome["udp_token"] = self.udp.register(client_socket)
+                welcome["udp_port"] = self.udp.port
+            if protocol.COMPRESSION in message_dict["protocols"] and welcome["protocol"] == "binary":
+                # Compressed writes travel in frames, so only binary clients can get them
+                welcome["compression"] = protocol.COMPRESSION
+            self.send(client_socket, welcome)
+            if "compression" in welcome:
+                client_socket.enable_compression()
+        if "map_hashes" in message_dict:
+            # Newer client, send the static layer unless it already has this map cached
+            self.send_static_map(client_socket, message_dict["map_hashes"])
+        else:
+            self.legacy_clients.add(client_socket)
+
+        if resumed is not None and resumed >= self.history_floor and client_socket not in self.legacy_clients:
+            # Same player again, only send the object changes made while they were away
+            self.client_versions[client_socket] = resumed
 
-        print(f"Player {player_name} joined the game at ({x}, {y})")
+        resume = message_dict.get("resume")
+        if isinstance(resume, dict) and resume.get("match") == self.match_id and client_socket not in self.legacy_clients:
+            version = resume.get("version")
+            if isinstance(version, int) and self.history_floor <= version <= self.version:
+                # Rejoining the same match: objects at that version plus the changes since, not a full snapshot
+                self.client_versions[client_socket] = version
+
+        self.socket_map[player_name] = client_socket
+        if resumed is None:
+            self.player_positions[player_name] = {"x": x, "y": y}
+            self.record("j", player_name, x, y)
+            self.interest.move(player_name, x, y)
+            self.passed_door[player_name] = False
+            print(f"Player {player_name} joined the game at ({x}, {y})")
+        else:
+            print(f"Player {player_name} resumed their session.")
 
         # Sync state to all clients
-        self.broadcast({
-            "type": "sync_positions",
-            "players": self.player_positions
-        })
+        self.send_player_ids()
+        self.sync_positions()
         self.sync_objects()
+        return True
+
+    # Sends the wall and floor layer, or only its hash if the client already has it
+    # A map file is too big to send whole, the client then asks for chunks with get_chunks
+    def send_static_map(self, client_socket, cached_hashes=()):
+        if self.map_file is not None:
+            self.send(client_socket, {
+                "type": "static_map",
+                "hash": self.map_hash,
+                "width": self.map_file.width,
+                "height": self.map_file.height,
+                "chunk_size": self.map_file.chunk_size
+            })
+            return
+        message = {
+            "type": "static_map",
+            "hash": self.map_hash,
+            "width": max(len(row) for row in self.map_rows),
+            "height": len(self.map_rows)
+        }
+        if self.map_hash not in cached_hashes:
+            message["rows"] = self.map_encoded
+        self.send(client_socket, message)
 
+    # Client lost its cached copy, send the full static layer
+    def handle_get_static_map(self, client_socket, message_dict):
+        self.send_static_map(client_socket)
+
+    # Sends the map chunks listed as [[chunk x, chunk y], ...], run-length encoded like static_map rows
+    def handle_get_chunks(self, client_socket, message_dict):
+        if self.map_file is None:
+            return
+        chunks = message_dict.get("chunks")
+        if not isinstance(chunks, list):
+            return
+        for chunk in chunks[:MAX_CHUNKS_PER_REQUEST]:
+            if not (isinstance(chunk, list) and len(chunk) == 2 and all(isinstance(n, int) for n in chunk)):
+                continue
+            cx, cy = chunk
+            if not self.map_file.has_chunk(cx, cy):
+                continue
+            self.send(client_socket, {
+                "type": "map_chunk",
+                "hash": self.map_hash,
+                "x": cx,
+                "y": cy,
+                "rows": self.map_file.encoded_chunk(cx, cy)
+            })
 
     def handle_move(self, client_socket, message_dict):
         player_name = message_dict.get("player")
         position = message_dict.get("position")
         sprite_counter = message_dict.get("sprite_counter")
         if player_name in self.player_positions:
-            if sprite_counter is None:
-                sprite_counter = self.player_positions[player_name]["sprite_counter"]
+            old = self.player_positions[player_name]
+            if not self.is_valid_move(old, position):
+                # Tell the sender where the player really is so it can snap back
+                self.send(client_socket, {
+                    "type": "correction",
+                    "player": player_name,
+                    "position": [old["x"], old["y"]]
+                })
+                return
+            if not protocol.valid_sprite_counter(sprite_counter):
+                sprite_counter = old.get("sprite_counter")  # Not sent, or not one the protocol can carry
             self.player_positions[player_name] = {"x": position[0], "y": position[1], "sprite_counter": sprite_counter}
+            self.interest.move(player_name, position[0], position[1])
+            self.record("m", player_name, position[0], position[1], sprite_counter)
         else:
             print(f"Error: Player {player_name} not found")
             return
 
-        self.broadcast({
-            "type": "sync_positions",
-            "players": self.player_positions
+        if self.tick_rate > 0 or self.defer_sync:
+            self.positions_dirty = True  # Sent with the next tick or flush, last position wins
+        else:
+            self.sync_positions(reliable=False)
+
+    # A move may go at most one tile from the last accepted position, counting both axes
+    # (players move along one axis at a time, a diagonal could slip between two walls
+    # that only touch at a corner), and may not overlap a wall or a locked door,
+    # checked in constant time on the grid
+    def is_valid_move(self, old, position):
+        if not isinstance(position, (list, tuple)) or len(position) != 2:
+            return False
+        x, y = position
+        if type(x) not in (int, float) or type(y) not in (int, float):
+            return False
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return False
+        if abs(x - old["x"]) + abs(y - old["y"]) > 1:
+            return False
+        return not self.grid.is_area_blocked(x, y)
+
+    # Joins and leaves go out reliably, regular movement updates may use UDP
+    def sync_positions(self, reliable=True):
+        self.positions_dirty = False
+        positions = dict(self.player_positions)  # Copy, other threads may be adding players
+        if self.interest_radius <= 0:
+            self.broadcast({"type": "sync_positions", "players": positions}, unreliable=not reliable)
+            return
+        # Each client only hears about the players around it
+        started = time.perf_counter()
+        encoded = {}  # (visible names, protocol) -> bytes, clients that see the same players share it
+        for name, client in list(self.socket_map.items()):
+            own = positions.get(name)
+            if own is None:
+                continue
+            visible = frozenset(other for other in self.interest.nearby(own["x"], own["y"], self.interest_radius)
+                                if other in positions)
+            self.update_visibility(client, visible, positions)
+            proto = self.client_protocols.get(client, "json")
+            if (visible, proto) not in encoded:
+                message = {"type": "sync_positions", "players": {other: positions[other] for other in visible}}
+                encoded[(visible, proto)] = protocol.encode(message, proto, self.player_ids)
+            self.deliver(client, proto, encoded[(visible, proto)], "sync_positions", not reliable)
+        metrics.observe("broadcast.sync_positions", time.perf_counter() - started)
+
+    # Tells a client which players came into or went out of its area since the last update
+    # Sent over TCP so a lost datagram can't leave a stale player on screen
+    def update_visibility(self, client, visible, positions):
+        known = self.visible.get(client, frozenset())
+        if visible == known:
+            return
+        self.visible[client] = visible
+        self.send(client, {
+            "type": "visibility",
+            "entered": {name: positions[name] for name in visible - known},
+            "left": sorted(known - visible)
         })
 
+    # Called tick_rate times per second, folds all moves since the last tick into one broadcast
+    def tick(self):
+        if self.suspended:
+            self.expire_sessions()
+        if self.positions_dirty:
+            self.sync_positions(reliable=False)
+
+    # Sends what a batch of commands changed, at most one update of each kind
+    # Positions still wait for the tick unless ticks are off
+    def flush(self):
+        if self.objects_dirty:
+            self.sync_objects()
+        if self.positions_dirty and self.tick_rate <= 0:
+            self.sync_positions(reliable=False)
+
     def handle_objects(self, client_socket, message_dict):
         player_name = message_dict.get("player")
         position = message_dict.get("position")
         object_id = message_dict.get("object_id")
         possessed_by = message_dict.get("possessed_by")
         type_ = message_dict.get("type")
-        if object_id not in self.objects:
+        index = self.objects.index_of(object_id)
+        if index is None or KINDS[self.objects.kind[index]] != OBJECT_MESSAGE_KINDS.get(type_):
             return
-        if(type_ == "key"):
-            obj = self.objects[object_id]
-            obj["possessed_by"] = possessed_by
+        if(type_ == "key" or type_ == "pickup"):
+            if possessed_by is not None and not isinstance(possessed_by, str):
+                return
+            self.objects.set_owner(index, possessed_by)
+            self.mark_changed(object_id)
+            self.record("p", self.version, object_id, possessed_by)
 
         if(type_ == "unlock"):
-            self.objects[object_id]["locked"] = False
+            self.objects.locked[index] = 0
+            self.grid.remove(self.objects.x[index], self.objects.y[index], LOCKED_DOOR)  # Door is walkable from now on
+            self.mark_changed(object_id)
+            self.record("u", self.version, object_id)
 
         if(type_ == "delete_key"):
             print(f"Deleting key {object_id}")
-            del self.objects[object_id]
+            self.objects.remove(index)
+            self.grid.remove(self.objects.x[index], self.objects.y[index], KEY)
+            self.mark_changed(object_id, "remove")
+            self.record("d", self.version, object_id)
 
 
-        self.sync_objects()
+        if self.defer_sync:
+            self.objects_dirty = True
+        else:
+            self.sync_objects()
 
     def check_all_players_passed_door(self):
         if all(self.passed_door.values()):
@@ -148,19 +473,98 @@ class SyncManager:
             })
 
     def is_near(self, door, key):
-        door_rect = pygame.Rect(door["x"], door["y"], 50, 50)
-        key_rect = pygame.Rect(key["x"], key["y"], 50, 50)
-        return door_rect.colliderect(key_rect)
+        door_rect = rect(door["x"], door["y"], 50, 50)
+        key_rect = rect(key["x"], key["y"], 50, 50)
+        return rects_overlap(door_rect, key_rect)
+
+    # Walls and floors for clients that build the map from sync_objects, expanded the first time one needs them
+    def legacy_static_objects(self):
+        if self.static_objects is None:
+            self.static_objects = store_walls_and_floors(self.map_rows)
+        return self.static_objects
 
+    # Sends each client only the objects that changed since the version it acknowledged.
+    # Clients that never acked (older builds) or fell out of the history get a full snapshot.
     def sync_objects(self):
-        self.broadcast({
+        self.objects_dirty = False
+        started = time.perf_counter()
+        snapshot = None
+        legacy_snapshot = None
+        deltas = {}  # base_version -> encoded delta, shared by clients at the same version
+        wrapped = {}  # (payload key, protocol) -> bytes ready to send
+        for client in list(self.clients):
+            base = self.client_versions.get(client)
+            if base is not None and base >= self.version:
+                continue  # Already up to date
+            if client in self.legacy_clients:
+                # Older clients build the whole map from sync_objects, include walls and floors
+                if legacy_snapshot is None:
+                    legacy_snapshot = json.dumps({
+                        "type": "sync_objects",
+                        "version": self.version,
+                        "objects": {**self.legacy_static_objects().wire(), **self.objects.wire()}
+                    }).encode()
+                data, key = legacy_snapshot, "legacy"
+            elif base is None or base < self.history_floor:
+                if snapshot is None:
+                    snapshot = json.dumps({
+                        "type": "sync_objects",
+                        "version": self.version,
+                        "objects": self.objects.wire()
+                    }).encode()
+                data, key = snapshot, "snapshot"
+            else:
+                if base not in deltas:
+                    added, changed, removed = self.changes_since(base)
+                    deltas[base] = json.dumps({
+                        "type": "sync_delta",
+                        "base": base,
+                        "version": self.version,
+                        "added": added,
+                        "changed": changed,
+                        "removed": removed
+                    }).encode()
+                data, key = deltas[base], base
+            proto = self.client_protocols.get(client, "json")
+            if (key, proto) not in wrapped:
+                wrapped[(key, proto)] = protocol.wrap_json(data, proto)
+            client.send(wrapped[(key, proto)], "sync_objects")
+        metrics.observe("broadcast.sync_objects", time.perf_counter() - started)
+
+    # Client confirms it has applied everything up to message_dict["version"]
+    def handle_ack(self, client_socket, message_dict):
+        version = message_dict.get("version")
+        if not isinstance(version, int) or version > self.version:
+            return
+        if version >= self.client_versions.get(client_socket, -1):
+            self.client_versions[client_socket] = version
+
+    # Client could not apply a delta, send it the whole object set again
+    def handle_resync(self, client_socket, message_dict):
+        self.client_versions.pop(client_socket, None)
+        objects = self.objects.wire()
+        if client_socket in self.legacy_clients:
+            objects = {**self.legacy_static_objects().wire(), **objects}
+        self.send(client_socket, {
             "type": "sync_objects",
-            "objects": self.objects
+            "version": self.version,
+            "objects": objects
         })
 
-    def handle_disconnect(self, client_socket):
+    # Forgets everything about one connection, returns the object version it last acknowledged
+    def detach_client(self, client_socket):
         if client_socket in self.clients:
             self.clients.remove(client_socket)
+        acked = self.client_versions.pop(client_socket, None)
+        self.legacy_clients.discard(client_socket)
+        self.client_protocols.pop(client_socket, None)
+        self.visible.pop(client_socket, None)
+        if self.udp is not None:
+            self.udp.unregister(client_socket)
+        return acked
+
+    def handle_disconnect(self, client_socket):
+        acked = self.detach_client(client_socket)
 
         # Find the player name associated with this socket
         disconnected_player = None
@@ -171,37 +575,76 @@ class SyncManager:
                 break
 
         if disconnected_player:
+            if self.session_grace > 0 and disconnected_player in self.player_sessions:
+                # Keep their position and keys, the client may come back with its session token
+                print(f"Player {disconnected_player} disconnected, holding their session for {self.session_grace}s.")
+                self.suspended[disconnected_player] = (time.monotonic() + self.session_grace, acked)
+                return
             print(f"Player {disconnected_player} disconnected.")
-            
-            # Remove player from position and door tracking
-            del self.player_positions[disconnected_player]
-            if disconnected_player in self.passed_door:
-                del self.passed_door[disconnected_player]
-
-            # Release any objects they were possessing
-            for obj in self.objects.values():
-                if obj.get("possessed_by") == disconnected_player:
-                    obj["possessed_by"] = None
-
-            # Check if no players remain and reset the game state
-            if not self.player_positions:  # If no players are left
-                print("No players remaining. Resetting the game state.")
-                self.reset_game_state()
-
-            # Broadcast updated game state
-            self.broadcast({
-                "type": "sync_positions",
-                "players": self.player_positions
-            })
-            self.sync_objects()
+            self.remove_player(disconnected_player)
+
+    # Hands the player's session to a new connection if the token matches
+    # Returns the object version the player last acknowledged (-1 if none), or None without a valid session
+    # The old connection may not have noticed it is dead yet, it is detached and closed
+    def resume_session(self, player_name, token):
+        if not token or self.sessions.get(token) != player_name or player_name not in self.player_positions:
+            return None
+        if player_name in self.suspended:
+            _, acked = self.suspended.pop(player_name)
+        else:
+            old = self.socket_map.pop(player_name, None)
+            acked = self.detach_client(old) if old is not None else None
+            if old is not None:
+                old.close()
+        return acked if acked is not None else -1
+
+    # Drops players whose grace period ran out, called from tick()
+    def expire_sessions(self):
+        now = time.monotonic()
+        for player_name, (deadline, _) in list(self.suspended.items()):
+            if now >= deadline:
+                print(f"Player {player_name} did not come back, removing them.")
+                self.remove_player(player_name)
+
+    def remove_player(self, disconnected_player):
+        self.suspended.pop(disconnected_player, None)
+        token = self.player_sessions.pop(disconnected_player, None)
+        self.sessions.pop(token, None)
+
+        # Remove player from position and door tracking
+        del self.player_positions[disconnected_player]
+        self.interest.remove(disconnected_player)
+        player_id = self.player_ids.pop(disconnected_player, None)
+        self.player_names.pop(player_id, None)
+        if disconnected_player in self.passed_door:
+            del self.passed_door[disconnected_player]
+
+        # Release any objects they were possessing
+        for index in self.objects.owned_by(disconnected_player):
+            self.objects.set_owner(index, None)
+            self.mark_changed(self.objects.object_id(index))
+        self.record("l", self.version, disconnected_player)
+
+        # Check if no players remain and reset the game state
+        if not self.player_positions:  # If no players are left
+            print("No players remaining. Resetting the game state.")
+            self.reset_game_state()
+
+        # Broadcast updated game state
+        self.sync_positions()
+        self.sync_objects()
 
     def reset_game_state(self):
         """Reset all game data, objects, and status for a fresh start."""
         # Clear player positions
         self.player_positions.clear()
+        self.interest.clear()
+        self.visible.clear()
+        self.sessions.clear()
+        self.player_sessions.clear()
+        self.suspended.clear()
 
         # Reset door and other game objects
-        self.objects.clear()
         self.door_unlocked = False
         self.passed_door.clear()
 
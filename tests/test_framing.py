@@ -0,0 +1,114 @@
+# test_framing.py
+import json
+import socket
+import pytest
+import protocol
+from framing import FrameReader
+from protocol import MSG_JSON, MSG_MOVE, MSG_ZLIB
+
+def line(message):
+    return json.dumps(message).encode() + b"\n"
+
+def frame(message):
+    return protocol.encode_frame(MSG_JSON, json.dumps(message).encode())
+
+def decoded(messages):
+    return [protocol.decode(msg_type, payload, {}) for msg_type, payload in messages]
+
+MESSAGES = [{"type": "join", "player": "a"}, {"type": "ack", "version": 3}, {"type": "resync"}]
+
+def test_mixed_lines_and_frames():
+    reader = FrameReader()
+    reader.feed(line(MESSAGES[0]) + frame(MESSAGES[1]) + line(MESSAGES[2]))
+    assert decoded(reader.messages()) == MESSAGES
+    assert reader.leftover() == b""
+
+def test_split_one_byte_at_a_time():
+    data = line(MESSAGES[0]) + frame(MESSAGES[1]) + line(MESSAGES[2])
+    reader = FrameReader(start_size=16)
+    received = []
+    for i in range(len(data)):
+        reader.feed(data[i:i + 1])
+        received += reader.messages()
+    assert decoded(received) == MESSAGES
+
+def test_unfinished_message_is_kept():
+    reader = FrameReader()
+    data = frame(MESSAGES[0])
+    reader.feed(line(MESSAGES[1]) + data[:5])
+    assert decoded(reader.messages()) == [MESSAGES[1]]
+    assert reader.leftover() == data[:5]
+    reader.feed(data[5:])
+    assert decoded(reader.messages()) == [MESSAGES[0]]
+
+def test_max_messages_keeps_the_rest():
+    reader = FrameReader()
+    reader.feed(b"".join(line(m) for m in MESSAGES))
+    assert decoded(reader.messages(max_messages=2)) == MESSAGES[:2]
+    assert decoded(reader.messages()) == MESSAGES[2:]
+
+def test_oversized_frame_is_refused():
+    reader = FrameReader(max_message=100)
+    reader.feed(protocol.HEADER.pack(protocol.FRAME_MAGIC, MSG_JSON, 101))
+    with pytest.raises(ValueError):
+        reader.messages()
+
+def test_oversized_line_is_refused():
+    reader = FrameReader(max_message=100)
+    reader.feed(b"x" * 101)
+    with pytest.raises(ValueError):
+        reader.messages()
+
+def test_big_frame_after_many_small_lines():
+    reader = FrameReader()
+    big = {"type": "sync_objects", "objects": "x" * (2 * 1024 * 1024)}
+    data = b"".join(line({"type": "ack", "version": i}) for i in range(5000)) + frame(big)
+    received = []
+    for start in range(0, len(data), 4096):
+        reader.feed(data[start:start + 4096])
+        received += reader.messages()
+    assert decoded(received) == [{"type": "ack", "version": i} for i in range(5000)] + [big]
+
+def test_recv_from_grows_a_small_buffer():
+    reader = FrameReader(start_size=64)
+    left, right = socket.socketpair()
+    try:
+        big = {"type": "sync_objects", "objects": "x" * 100000}
+        left.sendall(frame(big) + line(MESSAGES[0]))
+        left.close()
+        received = []
+        while reader.recv_from(right):
+            received += reader.messages()
+        assert decoded(received) == [big, MESSAGES[0]]
+    finally:
+        right.close()
+
+def test_compressed_frames_are_inflated():
+    compressor = protocol.new_compressor()
+    def deflated(data):
+        return protocol.encode_frame(MSG_ZLIB, compressor.compress(data) + compressor.flush(protocol.zlib.Z_SYNC_FLUSH))
+    move = protocol.encode({"type": "move", "player": "a", "position": [1, 2], "sprite_counter": 3}, "binary", {"a": 7})
+    reader = FrameReader()
+    reader.enable_compression()
+    # Plain messages may come before and between the compressed ones
+    reader.feed(line(MESSAGES[0]) + deflated(frame(MESSAGES[1]) + move) + deflated(line(MESSAGES[2])))
+    received = reader.messages()
+    assert [msg_type for msg_type, _ in received] == [MSG_JSON, MSG_JSON, MSG_MOVE, MSG_JSON]
+    assert decoded(received[:2] + received[3:]) == MESSAGES
+    assert protocol.decode(*received[2], {7: "a"})["position"] == [1, 2]
+
+def test_compressed_frames_pass_through_until_enabled():
+    compressor = protocol.new_compressor()
+    payload = compressor.compress(line(MESSAGES[0])) + compressor.flush(protocol.zlib.Z_SYNC_FLUSH)
+    reader = FrameReader()
+    reader.feed(protocol.encode_frame(MSG_ZLIB, payload))
+    assert reader.messages() == [(MSG_ZLIB, payload)]
+
+def test_compressed_frame_expanding_past_the_limit_is_refused():
+    compressor = protocol.new_compressor()
+    payload = compressor.compress(b"x" * 10000) + compressor.flush(protocol.zlib.Z_SYNC_FLUSH)
+    reader = FrameReader(max_message=1000)
+    reader.enable_compression()
+    reader.feed(protocol.encode_frame(MSG_ZLIB, payload))
+    with pytest.raises(ValueError):
+        reader.messages()
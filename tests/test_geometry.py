@@ -0,0 +1,25 @@
+# test_geometry.py
+import itertools
+import pytest
+from geometry import rect, rects_overlap
+
+def test_edges_and_empty_rects_do_not_overlap():
+    assert rects_overlap(rect(0, 0, 10, 10), rect(5, 5, 10, 10))
+    assert not rects_overlap(rect(0, 0, 10, 10), rect(10, 0, 10, 10))
+    assert not rects_overlap(rect(0, 0, 10, 10), rect(5, 5, 0, 10))
+
+def test_coordinates_are_truncated():
+    assert rect(1.9, -1.9, 10.7, 3.2) == (1, -1, 10, 3)
+
+def test_negative_sizes_extend_left_and_up():
+    assert rect(10, 10, -4, -6) == (6, 4, 4, 6)
+
+def test_matches_pygame_colliderect():
+    pygame = pytest.importorskip("pygame")
+    values = [-3, 0, 2.5, 5]
+    sizes = [-4, 0, 3, 5.5]
+    for x, y, width, height in itertools.product(values, values, sizes, sizes):
+        a = (x, y, width, height)
+        for b in [(0, 0, 5, 5), (2, 2, -3, 4), (4, -1, 1, 1)]:
+            expected = bool(pygame.Rect(*a).colliderect(pygame.Rect(*b)))
+            assert rects_overlap(rect(*a), rect(*b)) == expected, (a, b)
@@ -0,0 +1,51 @@
+# test_objectstore.py
+import pytest
+from config import tile_map
+from objectstore import ObjectStore, DOOR, KEY, store_walls_and_floors, store_special_tiles
+from tilemap import expand_tile_map
+
+SMALL_MAP = [
+    "BBBBBBB",
+    "BP.KDYB",
+    "B.EBGFB",
+    "BXZ..PB",
+    "BBBBBBB",
+]
+
+@pytest.mark.parametrize("rows", [SMALL_MAP, tile_map], ids=["small", "config"])
+def test_wire_matches_expand_tile_map(rows):
+    static_objects, dynamic_objects, spawn_points = expand_tile_map(rows)
+    objects, spawns = store_special_tiles(rows)
+    assert store_walls_and_floors(rows).wire() == static_objects
+    assert objects.wire() == dynamic_objects
+    assert spawns == spawn_points
+
+def test_index_of():
+    objects, _ = store_special_tiles(SMALL_MAP)
+    assert objects.object_id(objects.index_of("door1")) == "door1"
+    assert objects.object_id(objects.index_of("key3")) == "key3"
+    for object_id in ["key4", "door", "1", "key-1", "wall0", "key²", "key١", "", None, 3]:
+        assert objects.index_of(object_id) is None
+
+def test_removed_objects_are_gone():
+    objects, _ = store_special_tiles(SMALL_MAP)
+    count = len(objects)
+    index = objects.index_of("key0")
+    objects.remove(index)
+    objects.remove(index)  # Removing again changes nothing
+    assert "key0" not in objects and "key1" in objects
+    assert objects.get("key0") is None
+    assert "key0" not in objects.wire()
+    assert len(objects) == count - 1
+
+def test_owners():
+    objects = ObjectStore()
+    key = objects.add(KEY, 1, 1, "red")
+    door = objects.add(DOOR, 2, 2, "red", locked=True)
+    objects.set_owner(key, "alice")
+    assert objects.get("key0")["possessed_by"] == "alice"
+    assert objects.owned_by("alice") == [key]
+    assert objects.owned_by("bob") == []
+    objects.set_owner(key, None)
+    assert objects.owned_by("alice") == []
+    assert objects.wire_object(door) == {"id": "door0", "type": "door", "x": 2, "y": 2, "color": "red", "locked": True}
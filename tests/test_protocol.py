@@ -0,0 +1,72 @@
+# test_protocol.py
+import json
+import pytest
+import protocol
+from framing import FrameReader
+
+IDS = {"alice": 1, "bob": 2}
+NAMES = {1: "alice", 2: "bob"}
+
+def round_trip(message, wire_protocol):
+    reader = FrameReader()
+    reader.feed(protocol.encode(message, wire_protocol, IDS))
+    (msg_type, payload), = reader.messages()
+    return protocol.decode(msg_type, payload, NAMES)
+
+@pytest.mark.parametrize("wire_protocol", ["json", "binary"])
+def test_move_round_trip(wire_protocol):
+    move = {"type": "move", "player": "alice", "position": [12.5, 3.25], "sprite_counter": 4}
+    assert round_trip(move, wire_protocol) == move
+
+@pytest.mark.parametrize("wire_protocol", ["json", "binary"])
+def test_positions_round_trip(wire_protocol):
+    message = {"type": "sync_positions", "players": {
+        "alice": {"x": 1.5, "y": 2.0, "sprite_counter": 0},
+        "bob": {"x": 2047.0, "y": 0.03125, "sprite_counter": 127},
+    }}
+    assert round_trip(message, wire_protocol) == message
+
+def test_other_messages_go_as_json_frames():
+    message = {"type": "sync_delta", "base": 1, "version": 2, "added": {}, "changed": {}, "removed": ["key0"]}
+    data = protocol.encode(message, "binary", IDS)
+    assert data[0] == protocol.FRAME_MAGIC and data[1] == protocol.MSG_JSON
+    assert round_trip(message, "binary") == message
+    assert protocol.encode(message) == json.dumps(message).encode() + b"\n"
+
+def test_positions_are_quantized():
+    move = {"type": "move", "player": "bob", "position": [1.01, 70000], "sprite_counter": 1}
+    assert round_trip(move, "binary")["position"] == [1.0, 0xFFFF / protocol.POSITION_SCALE]
+
+@pytest.mark.parametrize("sprite_counter", [None, -1, 128, 500, 3.5, "x", True])
+def test_sprite_counters_the_byte_cant_hold_are_dropped(sprite_counter):
+    move = {"type": "move", "player": "alice", "position": [1, 1], "sprite_counter": sprite_counter}
+    assert round_trip(move, "binary")["sprite_counter"] is None
+    positions = {"type": "sync_positions", "players": {"alice": {"x": 1, "y": 1, "sprite_counter": sprite_counter}}}
+    assert round_trip(positions, "binary")["players"]["alice"] == {"x": 1, "y": 1}
+
+def test_players_without_an_id_are_left_out():
+    message = {"type": "sync_positions", "players": {"alice": {"x": 1, "y": 1}, "carol": {"x": 2, "y": 2}}}
+    assert list(round_trip(message, "binary")["players"]) == ["alice"]
+
+def test_bad_frames_are_refused():
+    with pytest.raises(ValueError):
+        protocol.decode(protocol.MSG_MOVE, b"\x00" * 3, NAMES)
+    with pytest.raises(ValueError):
+        protocol.decode(protocol.MSG_POSITIONS, protocol.COUNT.pack(2) + b"\x00" * protocol.PLAYER_STATE.size, NAMES)
+    with pytest.raises(ValueError):
+        protocol.decode(99, b"", NAMES)
+
+def test_wrap_json_matches_encode():
+    message = {"type": "ack", "version": 5}
+    serialized = json.dumps(message).encode()
+    for wire_protocol in ("json", "binary"):
+        assert protocol.wrap_json(serialized, wire_protocol) == protocol.encode(message, wire_protocol, IDS)
+
+def test_datagram_round_trip():
+    payload = protocol.PLAYER_STATE.pack(1, 32, 64, 2)
+    data = protocol.encode_datagram(protocol.DGRAM_MOVE, 42, payload)
+    assert protocol.decode_datagram(data) == (protocol.DGRAM_MOVE, 42, payload)
+    with pytest.raises(ValueError):
+        protocol.decode_datagram(b"\x00" * protocol.DATAGRAM_HEADER.size)
+    with pytest.raises(ValueError):
+        protocol.decode_datagram(b"\xfe")
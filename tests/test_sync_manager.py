@@ -0,0 +1,70 @@
+# test_sync_manager.py
+from config import delta_history
+from objectstore import KEY, store_special_tiles
+from sync_manager import SyncManager
+
+MAP = [
+    "BBBBB",
+    "BPKDB",
+    "BYE.B",
+    "BBBBB",
+]
+
+def manager():
+    sm = SyncManager()
+    sm.objects, sm.spawn_points = store_special_tiles(MAP)
+    return sm
+
+def test_change_is_sent_with_the_latest_state():
+    sm = manager()
+    base = sm.version
+    sm.objects.set_owner(sm.objects.index_of("key0"), "alice")
+    sm.mark_changed("key0")
+    sm.objects.set_owner(sm.objects.index_of("key0"), "bob")
+    sm.mark_changed("key0")
+    added, changed, removed = sm.changes_since(base)
+    assert added == {} and removed == []
+    assert changed == {"key0": sm.objects.get("key0")}
+    assert changed["key0"]["possessed_by"] == "bob"
+
+def test_added_then_removed_is_only_removed():
+    sm = manager()
+    base = sm.version
+    index = sm.objects.add(KEY, 3, 2, "red")
+    object_id = sm.objects.object_id(index)
+    sm.mark_changed(object_id, "add")
+    sm.mark_changed(object_id)
+    sm.objects.remove(index)
+    sm.mark_changed(object_id, "remove")
+    assert sm.changes_since(base) == ({}, {}, [object_id])
+
+def test_added_then_changed_is_added():
+    sm = manager()
+    base = sm.version
+    index = sm.objects.add(KEY, 3, 2, "red")
+    object_id = sm.objects.object_id(index)
+    sm.mark_changed(object_id, "add")
+    sm.objects.set_owner(index, "alice")
+    sm.mark_changed(object_id)
+    added, changed, removed = sm.changes_since(base)
+    assert added == {object_id: sm.objects.get(object_id)} and changed == {} and removed == []
+
+def test_changes_at_or_before_base_are_left_out():
+    sm = manager()
+    sm.mark_changed("door0")
+    base = sm.version
+    sm.objects.remove(sm.objects.index_of("key1"))
+    sm.mark_changed("key1", "remove")
+    assert sm.changes_since(base) == ({}, {}, ["key1"])
+    assert sm.changes_since(sm.version) == ({}, {}, [])
+
+def test_history_floor_follows_dropped_changes():
+    sm = manager()
+    floor = sm.history_floor
+    for _ in range(delta_history):
+        sm.mark_changed("door0")
+    assert sm.history_floor == floor
+    oldest = sm.object_changes[0][0]
+    sm.mark_changed("door0")
+    assert sm.history_floor == oldest  # A delta from before it would miss the dropped change
+    assert len(sm.object_changes) == delta_history
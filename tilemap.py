@@ -0,0 +1,98 @@
+# tilemap.py
+# Helpers shared by the server and the client for turning a tile_map
+# (list of strings) into game objects, and for sending it compactly.
+import hashlib
+
+# Map letters for keys and doors to their color
+color_map = {
+    "K": "red",     # Red Key
+    "G": "green",   # Green Key
+    "Y": "orange",  # Orange Key
+    "X": "maroon",  # Maroon Key
+    "D": "red",     # Red Door
+    "E": "green",   # Green Door
+    "F": "orange",  # Orange Door
+    "Z": "maroon"   # Maroon Door
+}
+
+# Short content hash identifying a map layout
+def map_hash(rows):
+    return hashlib.sha1("\n".join(rows).encode()).hexdigest()[:16]
+
+# Run-length encodes a map row, e.g. "BBBB..B" -> "4B2.B"
+def encode_row(row):
+    out = []
+    i = 0
+    while i < len(row):
+        j = i
+        while j < len(row) and row[j] == row[i]:
+            j += 1
+        count = j - i
+        out.append((str(count) if count > 1 else "") + row[i])
+        i = j
+    return "".join(out)
+
+def decode_row(encoded):
+    out = []
+    count = ""
+    for ch in encoded:
+        if ch.isdigit():
+            count += ch
+        else:
+            out.append(ch * (int(count) if count else 1))
+            count = ""
+    return "".join(out)
+
+def encode_rows(rows):
+    return [encode_row(row) for row in rows]
+
+def decode_rows(encoded_rows):
+    return [decode_row(row) for row in encoded_rows]
+
+# Expands a tile_map into game objects
+# Returns (static_objects, dynamic_objects, spawn_points):
+#   static_objects  walls and floors, these never change at runtime
+#   dynamic_objects doors and keys
+def expand_tile_map(rows):
+    static_objects = {}
+    dynamic_objects = {}
+    spawn_points = []
+    wall_number = 0
+    floor_number = 0
+    door_number = 0
+    key_number = 0
+    for i, row in enumerate(rows):
+        for j, tile in enumerate(row):
+            x, y = j, i
+            if tile == "B":
+                static_objects[f"wall{wall_number}"] = {"id": f"wall{wall_number}", "type": "wall", "x": x, "y": y}
+                wall_number += 1
+            elif tile in ["D", "E", "F", "Z"]:
+                dynamic_objects[f"door{door_number}"] = {"id": f"door{door_number}", "type": "door", "x": x, "y": y, "color": color_map[tile], "locked": True}
+                door_number += 1
+            elif tile in ["K", "Y", "G", "X"]:
+                static_objects[f"floor{floor_number}"] = {"id": f"floor{floor_number}", "type": "floor", "x": x, "y": y}
+                dynamic_objects[f"key{key_number}"] = {"id": f"key{key_number}", "type": "key", "x": x, "y": y, "color": color_map[tile], "possessed_by": None}
+                key_number += 1
+                floor_number += 1
+            elif tile == ".":
+                static_objects[f"floor{floor_number}"] = {"id": f"floor{floor_number}", "type": "floor", "x": x, "y": y}
+                floor_number += 1
+            elif tile == "P":
+                static_objects[f"floor{floor_number}"] = {"id": f"floor{floor_number}", "type": "floor", "x": x, "y": y}
+                floor_number += 1
+                spawn_points.append((x, y))
+    return static_objects, dynamic_objects, spawn_points
+
+# Walls and floors of one map chunk whose top left tile is (left, top)
+# Ids name the tile position, the running numbers of expand_tile_map need the whole map
+def expand_chunk(rows, left, top):
+    static_objects = {}
+    for i, row in enumerate(rows):
+        for j, tile in enumerate(row):
+            x, y = left + j, top + i
+            if tile == "B":
+                static_objects[f"wall{x}_{y}"] = {"id": f"wall{x}_{y}", "type": "wall", "x": x, "y": y}
+            elif tile in [".", "P", "K", "Y", "G", "X"]:
+                static_objects[f"floor{x}_{y}"] = {"id": f"floor{x}_{y}", "type": "floor", "x": x, "y": y}
+    return static_objects
@@ -0,0 +1,122 @@
+# udp.py
+# Optional UDP side channel for position updates. Everything else stays on the
+# TCP connection. Pairing rides on the TCP join: the welcome message carries a
+# token, the client sends it back in a HELLO datagram and from then on the
+# datagram's source address belongs to that connection.
+#
+# Datagrams carry a sequence number per direction. Anything not newer than the
+# last one received is stale and dropped, so a lost or reordered packet never
+# holds up the ones behind it.
+import asyncio
+import secrets
+import socket
+import threading
+import protocol
+
+class UdpChannel:
+    def __init__(self, port, dispatch, names_for):
+        self.port = port
+        self.dispatch = dispatch      # Same dispatch the TCP handlers use
+        self.names_for = names_for    # connection -> entity id to player name table
+        self.tokens = {}              # pairing token -> connection still waiting for its HELLO
+        self.addrs = {}               # connection -> (host, port) of its datagrams
+        self.conns = {}               # (host, port) -> connection
+        self.send_seq = {}            # connection -> last sequence number sent to it
+        self.recv_seq = {}            # connection -> newest move sequence number received
+        self.sendto = None            # Set when the socket is opened
+        self.lock = threading.Lock()
+
+    # Called from handle_join, returns the token the client must send back
+    def register(self, conn):
+        token = secrets.randbits(32)
+        with self.lock:
+            self.tokens[token] = conn
+        return token
+
+    def unregister(self, conn):
+        with self.lock:
+            for token, waiting in list(self.tokens.items()):
+                if waiting is conn:
+                    del self.tokens[token]
+            addr = self.addrs.pop(conn, None)
+            self.conns.pop(addr, None)
+            self.send_seq.pop(conn, None)
+            self.recv_seq.pop(conn, None)
+
+    def is_paired(self, conn):
+        return conn in self.addrs
+
+    # payload is the body of a binary MSG_POSITIONS frame
+    def send_positions(self, conn, payload):
+        with self.lock:
+            addr = self.addrs.get(conn)
+            if addr is None:
+                return False
+            seq = self.send_seq.get(conn, 0) + 1
+            self.send_seq[conn] = seq
+        datagram = protocol.encode_datagram(protocol.DGRAM_POSITIONS, seq, payload)
+        try:
+            self.sendto(datagram, addr)
+            conn.bytes_out += len(datagram)
+        except OSError:
+            pass  # Unreliable by design, the next tick sends fresh positions anyway
+        return True
+
+    def handle_datagram(self, data, addr):
+        try:
+            dgram_type, seq, payload = protocol.decode_datagram(data)
+        except ValueError:
+            return
+        if dgram_type == protocol.DGRAM_HELLO:
+            with self.lock:
+                conn = self.tokens.pop(seq, None)
+                if conn is not None:
+                    self.addrs[conn] = addr
+                    self.conns[addr] = conn
+                paired = addr in self.conns  # Also true for a repeated HELLO whose ack was lost
+            if paired:
+                self.sendto(protocol.encode_datagram(protocol.DGRAM_HELLO, seq), addr)
+        elif dgram_type == protocol.DGRAM_MOVE:
+            conn = self.conns.get(addr)
+            if conn is None:
+                return
+            conn.bytes_in += len(data)
+            with self.lock:
+                if seq <= self.recv_seq.get(conn, 0):
+                    return  # Stale or duplicate, a newer position already arrived
+                self.recv_seq[conn] = seq
+            try:
+                message_dict = protocol.decode(protocol.MSG_MOVE, payload, self.names_for(conn))
+            except ValueError:
+                return
+            self.dispatch(conn, message_dict)
+
+    # Thread mode: a blocking socket read by its own thread
+    def start_thread(self, host):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((host, self.port))
+        self.sendto = sock.sendto
+        threading.Thread(target=self.read_loop, args=(sock,), daemon=True).start()
+
+    def read_loop(self, sock):
+        while True:
+            try:
+                data, addr = sock.recvfrom(2048)
+            except OSError:
+                continue  # e.g. ICMP port unreachable from a client that went away
+            self.handle_datagram(data, addr)
+
+    # Async mode: a datagram endpoint on the running event loop
+    async def start_async(self, host):
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: DatagramHandler(self), local_addr=(host, self.port))
+        self.sendto = transport.sendto
+
+
+class DatagramHandler(asyncio.DatagramProtocol):
+    def __init__(self, channel):
+        self.channel = channel
+
+    def datagram_received(self, data, addr):
+        self.channel.handle_datagram(data, addr)